@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Measure the wall time, round trips, and bytes on the wire of every public
+MPDS method against an emulated device and fail if any method exceeds its
+round-trip budget."""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from aaopto_aotf.aotf import BAUDRATE, MPDS
+from aaopto_aotf.device_codes import InputMode
+from aaopto_aotf.emulator import EmulatedSerial, MPDSEmulator
+
+
+def reconfigure(aotf: MPDS, validate: bool = False):
+    """Set frequency, power, mode and output state of every channel."""
+    aotf.apply({channel: {'freq': 100 + channel, 'dbm': 15.0,
+                          'enabled': True, 'mode': InputMode.INTERNAL}
+                for channel in range(1, aotf.num_channels + 1)}, validate)
+
+
+def reconfigure_sequentially(aotf: MPDS, validate: bool = False):
+    """Same as :func:`reconfigure` with one call per setting."""
+    for channel in range(1, aotf.num_channels + 1):
+        aotf.set_channel_input_mode(channel, InputMode.INTERNAL)
+        aotf.set_frequency(channel, 100 + channel, validate=validate)
+        aotf.set_power_dbm(channel, 15.0, validate=validate)
+        aotf.enable_channel(channel)
+
+
+# name: (callable taking a connected MPDS, round-trip budget per call).
+# Budgets are per call and assume an 8-channel device where it matters.
+CASES = {
+    "get_lines_status": (lambda aotf: aotf.get_lines_status(), 1),
+    "get_channel_status": (lambda aotf: aotf.get_channel_status(1), 1),
+    "get_all_channel_status": (lambda aotf: aotf.get_all_channel_status(), 1),
+    "get_frequency (cached)": (lambda aotf: aotf.get_frequency(1), 0),
+    "get_blanking_mode (cached)": (lambda aotf: aotf.get_blanking_mode(), 0),
+    "get_product_id": (lambda aotf: aotf.get_product_id(), 1),
+    "set_frequency": (lambda aotf: aotf.set_frequency(1, 110.5), 2),
+    "set_frequency(validate=False)":
+        (lambda aotf: aotf.set_frequency(1, 110.5, validate=False), 1),
+    "set_power_dbm": (lambda aotf: aotf.set_power_dbm(1, 15.0), 2),
+    "set_power_dbm(validate=False)":
+        (lambda aotf: aotf.set_power_dbm(1, 15.0, validate=False), 1),
+    "enable_channel": (lambda aotf: aotf.enable_channel(1), 1),
+    "save_profile": (lambda aotf: aotf.save_profile(), 1),
+    "reset": (lambda aotf: aotf.reset(), 2),
+    "reconfigure all channels (apply)": (reconfigure, 1),
+    "reconfigure all channels (sequential)": (reconfigure_sequentially, 32),
+    "reconfigure all channels (apply, validated)":
+        (lambda aotf: reconfigure(aotf, validate=True), 1),
+    "reconfigure all channels (sequential, validated)":
+        (lambda aotf: reconfigure_sequentially(aotf, validate=True), 48),
+}
+CONSTRUCTOR_BUDGET = 1
+
+
+def measure(func, ser: EmulatedSerial, repeat: int):
+    """Call `func` `repeat` times and return per-call traffic and timing."""
+    times_s = []
+    ser.reset_counters()
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        times_s.append(time.perf_counter() - start_time)
+    return {'median_time_s': statistics.median(times_s),
+            'max_time_s': max(times_s),
+            'round_trips': ser.writes / repeat,
+            'bytes_written': ser.bytes_written / repeat,
+            'bytes_read': ser.bytes_read / repeat}
+
+
+def run(channels: int, baudrate: int, latency_s: float, repeat: int):
+    """Run every case and return a list of result dicts."""
+    results = []
+    ser = EmulatedSerial(MPDSEmulator(channels), baudrate, latency_s)
+    constructed = []
+    result = measure(lambda: constructed.append(MPDS("emulated", ser=ser)),
+                     ser, 1)
+    results.append(dict(name="MPDS()", budget=CONSTRUCTOR_BUDGET, **result))
+    aotf = constructed[0]
+    for name, (func, budget) in CASES.items():
+        # Warm the cache so that cached getters are measured as such.
+        aotf.refresh()
+        result = measure(lambda: func(aotf), aotf.ser, repeat)
+        results.append(dict(name=name, budget=budget, **result))
+    for result in results:
+        result['within_budget'] = result['round_trips'] <= result['budget']
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--channels", type=int, default=8, choices=(1, 4, 8),
+                        help="number of channels of the emulated device.")
+    parser.add_argument("--baudrate", type=int, default=BAUDRATE,
+                        help="emulated baud rate. 0 disables wire delays.")
+    parser.add_argument("--latency", type=float, default=0.0005,
+                        help="emulated device processing time per write [s].")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="calls per method.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="JSON output file. Defaults to stdout.")
+    args = parser.parse_args()
+    results = run(args.channels, args.baudrate, args.latency, args.repeat)
+    for result in results:
+        print(f"{result['name']:<40} {result['median_time_s'] * 1e3:>8.2f} ms"
+              f" {result['round_trips']:>5.1f}/{result['budget']} round trips"
+              f" {result['bytes_written'] + result['bytes_read']:>7.0f} B"
+              f"{'' if result['within_budget'] else '  OVER BUDGET'}",
+              file=sys.stderr)
+    output = json.dumps({'settings': vars(args), 'results': results},
+                        indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    sys.exit(0 if all(result['within_budget'] for result in results) else 1)
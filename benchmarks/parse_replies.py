@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Compare the per-reply cost of the `parse` templates against the
+precompiled reply parsers."""
+
+import argparse
+import timeit
+
+from parse import parse
+from aaopto_aotf.device_codes import Replies
+from aaopto_aotf.reply_parsers import (parse_blanking_status,
+                                       parse_channel_status, parse_line_status)
+
+CHANNEL_STATUS_REPLY = "l1F110.500P22.0S1"
+LINE_STATUS_REPLY = "l1 F=110.500 P=22.000 ON INTERNAL"
+BLANKING_STATUS_REPLY = "Blanking ON INTERNAL"
+LINE_STATUS_TEMPLATE = "l{channel} F={freq:.3f} P={power:.3f} {state} {mode}"
+BLANKING_STATUS_TEMPLATE = "{blanking} {state} {mode}"
+
+CASES = {
+    "channel status": (
+        lambda: parse(Replies.CHANNEL_SPECIFIC_STATUS, CHANNEL_STATUS_REPLY),
+        lambda: parse_channel_status(CHANNEL_STATUS_REPLY)),
+    "line status": (
+        lambda: parse(LINE_STATUS_TEMPLATE, LINE_STATUS_REPLY),
+        lambda: parse_line_status(LINE_STATUS_REPLY)),
+    "blanking status": (
+        lambda: parse(BLANKING_STATUS_TEMPLATE, BLANKING_STATUS_REPLY),
+        lambda: parse_blanking_status(BLANKING_STATUS_REPLY)),
+}
+
+
+def best_time_us(func, number: int, repeat: int):
+    """Return the best per-call time in [us] over several repeats."""
+    best_s = min(timeit.repeat(func, number=number, repeat=repeat))
+    return best_s / number * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20000,
+                        help="calls per timing repeat.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of timing repeats.")
+    args = parser.parse_args()
+    print(f"{'reply':<16} {'parse() [us]':>13} {'precompiled [us]':>17} "
+          f"{'speedup':>8}")
+    for name, (before, after) in CASES.items():
+        before_us = best_time_us(before, args.number, args.repeat)
+        after_us = best_time_us(after, args.number, args.repeat)
+        print(f"{name:<16} {before_us:>13.2f} {after_us:>17.2f} "
+              f"{before_us / after_us:>7.1f}x")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Summarize a recorded MPDS session and measure the driver's cost of
+reading each recorded query reply, as received from the real device."""
+
+import argparse
+import json
+import statistics
+import time
+
+from aaopto_aotf.aotf import MPDS, ReplyTimeoutError
+from aaopto_aotf.device_codes import CmdRoots
+from aaopto_aotf.stats import command_root
+from aaopto_aotf.transports import WRITE, ReplaySerial, load_session
+
+# Enough for any model, so that every recorded channel passes range checks.
+MAX_CHANNELS = 8
+
+# root: callable taking a connected MPDS and the written query.
+QUERIES = {
+    CmdRoots.LINES_STATUS: lambda aotf, data: aotf.get_lines_status(),
+    CmdRoots.CHANNEL_PREFIX:
+        lambda aotf, data: aotf.get_channel_status(int(data[1:-2])),
+    CmdRoots.PRODUCT_ID: lambda aotf, data: aotf.get_product_id(),
+}
+
+
+def exchanges(events):
+    """Split events into lists that each start with a write."""
+    split = []
+    for event in events:
+        if event.kind == WRITE:
+            split.append([])
+        if split:
+            split[-1].append(event)
+    return split
+
+
+def summarize(events):
+    """Return the duration and traffic of a recording."""
+    writes = [event for event in events if event.kind == WRITE]
+    return {'duration_s': events[-1].time_s - events[0].time_s,
+            'round_trips': len(writes),
+            'bytes_written': sum(len(event.data) for event in writes),
+            'bytes_read': sum(len(event.data) for event in events
+                              if event.kind != WRITE)}
+
+
+def time_queries(events, repeat: int):
+    """Time the driver reading every recorded single-query reply, without
+    wire delays.
+
+    :return: {root: {'replies', 'rejected', 'recorded_latency_s',
+        'driver_time_s'}}, where 'replies' counts the accepted replies.
+        Roots whose replies were all rejected have no times (None).
+    """
+    samples = {}  # root: ([recorded latency], [driver time])
+    rejected = {}  # root: replies the driver raised on (e.g: while booting)
+    for exchange in exchanges(events):
+        data = exchange[0].data
+        root = command_root(data)
+        if root not in QUERIES or data.count(b"\n") != 1:
+            continue  # Not a single query.
+        ser = ReplaySerial(exchange)
+        aotf = MPDS("replay", ser=ser, num_channels=MAX_CHANNELS)
+        try:
+            QUERIES[root](aotf, data)
+        except (ValueError, ReplyTimeoutError):  # e.g: truncated replies.
+            rejected[root] = rejected.get(root, 0) + 1
+            continue
+        times_s = []
+        for _ in range(repeat):
+            ser.rewind()
+            start_time = time.perf_counter()
+            QUERIES[root](aotf, data)
+            times_s.append(time.perf_counter() - start_time)
+        recorded, driver = samples.setdefault(root, ([], []))
+        recorded.append(exchange[-1].time_s - exchange[0].time_s)
+        driver.append(min(times_s))
+    results = {}
+    for root in list(samples) + [root for root in rejected
+                                 if root not in samples]:
+        recorded, driver = samples.get(root, ([], []))
+        results[root.name] = {
+            'replies': len(recorded),
+            'rejected': rejected.get(root, 0),
+            'recorded_latency_s':
+                statistics.mean(recorded) if recorded else None,
+            'driver_time_s': statistics.mean(driver) if driver else None}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("session",
+                        help="file recorded with "
+                             "aaopto_aotf.transports.RecordingSerial.")
+    parser.add_argument("--repeat", type=int, default=100,
+                        help="calls per recorded reply; the fastest counts.")
+    args = parser.parse_args()
+    events = load_session(args.session)
+    print(json.dumps({'session': summarize(events),
+                      'queries': time_queries(events, args.repeat)},
+                     indent=2))
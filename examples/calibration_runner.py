@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Calibrate many channels on many aotfs & power meters concurrently."""
+
+import argparse
+import json
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import Manager
+import numpy as np
+from tqdm import tqdm
+from calibration_sweep import (MEASUREMENT_SETTLING_TIME_S, MIN_SETTLE_TIME_S,
+                               PLATFORM, Sampler, connect_power_meter,
+                               prepare_channel, run_search,
+                               set_meter_wavelength)
+from aaopto_aotf.aotf import MPDS, MAX_POWER_DBM
+
+
+# Sweep settings of jobs that do not override them. Names match the
+# calibration_sweep.py arguments.
+SWEEP_DEFAULTS = {
+    'search': 'golden',
+    'min_freq': 0.0,
+    'max_freq': 150.0,
+    'freq_step': 0.1,
+    'min_power': 0.0,
+    'max_power': MAX_POWER_DBM,
+    'power_step': 0.1,
+    'coarse_freq_step': 0.5,
+    'coarse_power_step': 2.0,
+    'settle_tolerance': 0.01,
+    'max_settle_time': MEASUREMENT_SETTLING_TIME_S,
+    'min_settle_time': MIN_SETTLE_TIME_S,
+    'validate': False,
+    'power_curve': False,
+}
+# Settings that every job must have.
+JOB_KEYS = ('aotf_port', 'channel', 'wavelength', 'pm100_port')
+
+
+def group_rigs(jobs):
+    """Group the jobs that share an aotf or a power meter.
+
+    Each group is an independent rig whose jobs must run one at a time.
+
+    :return: lists of job indices.
+    """
+    parents = list(range(len(jobs)))
+
+    def root(index):
+        """Return the index that represents the group of a job."""
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    owners = {}  # {resource: index of the first job that uses it}
+    for index, job in enumerate(jobs):
+        for resource in (('aotf', job['aotf_port']),
+                         ('meter', job['pm100_port'])):
+            owner = owners.setdefault(resource, index)
+            parents[root(index)] = root(owner)
+    rigs = {}
+    for index in range(len(jobs)):
+        rigs.setdefault(root(index), []).append(index)
+    return list(rigs.values())
+
+
+def run_job(job, aotf, meter, progress):
+    """Calibrate one channel and return its result dict.
+
+    Only the combined progress view of the parent process is shown.
+    """
+    prepare_channel(aotf, job['channel'])
+    sampler = Sampler(aotf, meter, job['channel'], job['validate'], None,
+                      job['settle_tolerance'], job['max_settle_time'],
+                      progress, job['min_settle_time'])
+    try:
+        run_search(sampler, job['search'], job['min_power'],
+                   job['max_power'], job['power_step'], job['min_freq'],
+                   job['max_freq'], job['freq_step'],
+                   job['coarse_power_step'], job['coarse_freq_step'],
+                   job['power_curve'], show_progress=False)
+    finally:
+        sampler.close()
+        aotf.disable_channel(job['channel'])
+    return {'best_power': sampler.argmax_power,
+            'best_freq': sampler.argmax_freq,
+            'max_watts': sampler.max_watts,
+            'points': np.column_stack((sampler.power_xy, sampler.freq_xy,
+                                       sampler.watts_xy))}
+
+
+def calibrate_rig(indexed_jobs, progress_queue):
+    """Run the jobs of one rig in order. Runs in a worker process.
+
+    :param indexed_jobs: (index, job) pairs.
+    :param progress_queue: queue to put the index of a job on after each of
+        its measurements.
+    :return: a result dict per job. Failed jobs hold an ``'error'``.
+    """
+    aotfs = {}
+    meters = {}
+    results = []
+    for index, job in indexed_jobs:
+        try:
+            if job['aotf_port'] not in aotfs:
+                aotfs[job['aotf_port']] = MPDS(job['aotf_port'])
+            meter = meters.get(job['pm100_port'])
+            if meter is None:
+                meter = meters[job['pm100_port']] = connect_power_meter(
+                    job['wavelength'], job['pm100_port'])
+            else:
+                set_meter_wavelength(meter, job['wavelength'])
+            result = run_job(job, aotfs[job['aotf_port']], meter,
+                             partial(progress_queue.put, index))
+        except Exception as e:  # Keep going with the other jobs.
+            result = failed_result(e)
+        results.append((index, result))
+    for aotf in aotfs.values():
+        aotf.close()
+    if PLATFORM == 'win32':
+        for meter in meters.values():
+            meter.close()
+    return results
+
+
+def failed_result(error):
+    """Return the result dict of a job that failed with an exception."""
+    return {'error': repr(error), 'points': np.empty((0, 3))}
+
+
+def run(jobs, workers=None):
+    """Calibrate every job, running independent rigs concurrently.
+
+    :return: a result dict per job, in order. The jobs of a rig whose
+        worker process failed hold an ``'error'``.
+    """
+    rigs = group_rigs(jobs)
+    results = [None] * len(jobs)
+    bars = [tqdm(desc=f"{job['aotf_port']} channel {job['channel']} "
+                      f"({job['wavelength']}[nm])",
+                 position=index, unit=" points")
+            for index, job in enumerate(jobs)]
+    with Manager() as manager, \
+            ProcessPoolExecutor(max_workers=workers or len(rigs)) as executor:
+        progress_queue = manager.Queue()
+        futures = [executor.submit(calibrate_rig,
+                                   [(index, jobs[index]) for index in rig],
+                                   progress_queue)
+                   for rig in rigs]
+        while not all(future.done() for future in futures) \
+                or not progress_queue.empty():
+            try:
+                bars[progress_queue.get(timeout=0.2)].update()
+            except queue.Empty:
+                pass
+        for rig, future in zip(rigs, futures):
+            try:
+                for index, result in future.result():
+                    results[index] = result
+            except Exception as e:  # Keep the results of the other rigs.
+                for index in rig:
+                    results[index] = failed_result(e)
+    for bar in bars:
+        bar.close()
+    return results
+
+
+def save_results(path, jobs, results):
+    """Save every job, its best settings, and its measurements to one .npz
+    file.
+
+    The ``summary`` entry holds a JSON list with one dict per job; the
+    measurements of job i are in ``points_i`` as rows of (power [dBm],
+    frequency [MHz], watts [w]).
+    """
+    summary = [dict(job, **{key: value for key, value in result.items()
+                            if key != 'points'})
+               for job, result in zip(jobs, results)]
+    np.savez(path, summary=json.dumps(summary),
+             **{f"points_{index}": result['points']
+                for index, result in enumerate(results)})
+    return summary
+
+
+def main():
+    """Run the calibration jobs of a config file."""
+    description = """Calibrate several aotf channels, each with a Thorlabs
+        PM100 power meter at its output. Jobs that share an aotf or a power
+        meter run one after another; independent rigs run concurrently in
+        worker processes."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("config", type=str,
+                        help="JSON file with a list of 'jobs', each with an "
+                             "'aotf_port', 'channel', 'wavelength', and "
+                             "'pm100_port', and optional 'defaults' for the "
+                             "sweep settings of every job (see "
+                             "calibration_sweep.py). Jobs may override any "
+                             "sweep setting.")
+    parser.add_argument("--output", type=str, default="calibration.npz",
+                        help="the consolidated results file.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="maximum number of rigs to run at once. "
+                             "Defaults to all of them.")
+    args = parser.parse_args()
+    with open(args.config, 'r') as config_file:
+        config = json.load(config_file)
+    defaults = dict(SWEEP_DEFAULTS, **config.get('defaults', {}))
+    jobs = [dict(defaults, **job) for job in config['jobs']]
+    for job in jobs:
+        missing = [key for key in JOB_KEYS if key not in job]
+        if missing:
+            parser.error(f"Job {job} is missing {missing}.")
+    if PLATFORM == 'win32' and len({job['pm100_port'] for job in jobs}) > 1:
+        # connect_power_meter() opens the first power meter there.
+        parser.error("Only one power meter is supported on Windows.")
+
+    results = run(jobs, args.workers)
+    summary = save_results(args.output, jobs, results)
+    print()
+    for job in summary:
+        outcome = job.get('error') or (
+            f"{job['max_watts']:.6f}[w] at ({job['best_power']:.2f}[dBm], "
+            f"{job['best_freq']:.3f}[MHz])")
+        print(f"{job['aotf_port']} channel {job['channel']} "
+              f"({job['wavelength']}[nm]): {outcome}")
+    print(f"Saved results to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
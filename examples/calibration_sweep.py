@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
-"""Script to sample & plot a grid over power & frequency to find max output."""
+"""Script to sample & plot power & frequency settings to find max output."""
 
 import argparse
+import json
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import pprint
 import numpy as np
@@ -24,7 +27,7 @@ if PLATFORM == "win32":
             @property
             def read(self):
                 p = c_double()
-                meter.measPower(byref(p))
+                self.measPower(byref(p))
                 return p.value
 
     except ImportError:
@@ -33,17 +36,476 @@ else:
     from ThorlabsPM100 import ThorlabsPM100, USBTMC
 from aaopto_aotf.aotf import MPDS, MAX_POWER_DBM
 from aaopto_aotf.aotf import BlankingMode, InputMode
+from aaopto_aotf.calibration import Calibration, ChannelCalibration
 
 
 # Immutable Constants:
 MEASUREMENT_SETTLING_TIME_S = 0.5
+# Readings taken sooner than this after a change of settings may predate it:
+# the aotf output takes up to AOTF_RESPONSE_TIME_S to follow the new
+# settings, and the meter may return its previous reading until its next
+# update.
+METER_UPDATE_PERIOD_S = 0.01
+AOTF_RESPONSE_TIME_S = 0.001
+MIN_SETTLE_TIME_S = METER_UPDATE_PERIOD_S + AOTF_RESPONSE_TIME_S
+# A reading has settled once this many successive readings agree.
+SETTLE_READINGS = 3
+# Readings below this [w] are compared as if they were this large, since the
+# meter noise keeps tiny readings from agreeing to a relative tolerance.
+SETTLE_NOISE_FLOOR_W = 1e-6
+INV_GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+# Rows preallocated in a .npy output file when the point count is unknown.
+STORE_CHUNK_POINTS = 4096
+# Sweep arguments saved in the .npy header that a resumed run must match.
+HEADER_ARGS = ('channel', 'wavelength', 'min_freq', 'max_freq', 'freq_step',
+               'min_power', 'max_power', 'power_step', 'search',
+               'coarse_freq_step', 'coarse_power_step')
 
 
-if __name__ == "__main__":
+def connect_power_meter(wavelength, pm100_port):
+    """Connect to a Thorlabs PM100 power meter and set its wavelength [nm].
+
+    On Windows, pm100_port is ignored and the first power meter found is
+    opened.
+    """
+    if PLATFORM == 'win32':
+        # Duplicate the function signature of the USBTMC module.
+        # FIXME: put the connection attempt in a try-except with software link:
+        # https://www.thorlabs.com/software_pages/ViewSoftwarePage.cfm?Code=OPM
+        resource_name = create_string_buffer(1024)
+        meter = MyTLPM()
+        deviceCount = c_uint32()
+        meter.findRsrc(byref(deviceCount))  # We need to call this first.
+        meter.getRsrcName(c_int(0), resource_name)  # get name of first device.
+        meter.open(resource_name, c_bool(True), c_bool(True))
+        meter.setPowerUnit(c_int16(0))  # 0 --> watts
+    else:
+        inst = USBTMC(device=pm100_port)
+        meter = ThorlabsPM100(inst=inst)
+    set_meter_wavelength(meter, wavelength)
+    return meter
+
+
+def set_meter_wavelength(meter, wavelength):
+    """Set the wavelength [nm] that a power meter corrects for."""
+    if PLATFORM != 'win32':
+        meter.sense.correction.wavelength = wavelength
+        return
+    set_wavelength = c_double(0)
+    meter.getWavelength(c_int16(tlpm_mod.TLPM_ATTR_SET_VAL), byref(set_wavelength))
+    print(f"PM100 wavelength currently set to {set_wavelength.value}[nm].")
+    if abs(set_wavelength.value - wavelength) < 0.001:
+        print("PM100 already at correct wavelength. Skipping.")
+    else:
+        time.sleep(1.0) # Sleeping is necessary here.
+        # Otherwise reading current setting will change the set value.
+        print(f"Setting PM100 wavelength to {wavelength}[nm].")
+        meter.setWavelength(c_double(wavelength))
+
+
+def connect_aotf(aotf_port, channel):
+    """Connect to the aotf and enable one channel under internal control."""
+    aotf = MPDS(aotf_port)
+    prepare_channel(aotf, channel)
+    return aotf
+
+
+def prepare_channel(aotf, channel):
+    """Enable one channel under internal control."""
+    aotf.set_blanking_mode(BlankingMode.INTERNAL)
+    aotf.set_channel_input_mode(channel, InputMode.INTERNAL)
+    aotf.enable_channel(channel)
+
+
+def read_settled(meter, tolerance, max_wait_s, min_wait_s=MIN_SETTLE_TIME_S):
+    """Read the meter until SETTLE_READINGS successive readings agree within
+    a relative tolerance, or until max_wait_s has passed.
+
+    Call it right after changing the aotf settings. No reading is taken
+    before min_wait_s has passed, so that a stale reading from before the
+    change cannot count as settled, and successive readings are
+    METER_UPDATE_PERIOD_S apart, so that each is a new meter sample.
+
+    :param tolerance: largest accepted spread of the successive readings
+        relative to the last one. If 0, wait max_wait_s and read once.
+    :param min_wait_s: wait before the first reading.
+    :return: the last reading [w].
+    """
+    if tolerance <= 0:
+        time.sleep(max(max_wait_s, min_wait_s))
+        return meter.read
+    deadline = time.perf_counter() + max_wait_s
+    time.sleep(min_wait_s)
+    readings = [meter.read]
+    while time.perf_counter() < deadline:
+        time.sleep(METER_UPDATE_PERIOD_S)
+        readings.append(meter.read)
+        recent = readings[-SETTLE_READINGS:]
+        scale = max(abs(recent[-1]), SETTLE_NOISE_FLOOR_W)
+        if len(recent) == SETTLE_READINGS \
+                and max(recent) - min(recent) <= tolerance * scale:
+            break
+    return readings[-1]
+
+
+class CsvStore:
+    """Measurements written as lines of a CSV file."""
+
+    def __init__(self, path):
+        """Create (or truncate) the file and write the column names."""
+        self.file = open(path, 'w')
+        self.file.write("power [dbm], frequency [MHz], watts [w]\n")
+
+    def append(self, power, freq, watts):
+        """Write one measurement."""
+        self.file.write(f'{power}, {freq}, {watts}\n')
+
+    def close(self):
+        """Close the file."""
+        self.file.close()
+
+
+class NpyStore:
+    """Measurements stored as rows of (power [dBm], frequency [MHz],
+    watts [w]) in a memory-mapped .npy file, with the sweep arguments in a
+    JSON header file next to it.
+
+    Rows are preallocated as NaN and filled in order, so a run that stopped
+    early can be resumed, and the file loads back without parsing with
+    :func:`load_points`.
+    """
+
+    def __init__(self, path, header, capacity=STORE_CHUNK_POINTS,
+                 resume=False, overwrite=False):
+        """Create the file, or open it to append to if resuming.
+
+        :param header: dict describing the sweep. A resumed file must have
+            been created with the same header.
+        :param capacity: number of rows to preallocate. The file doubles in
+            size (by at least STORE_CHUNK_POINTS rows) whenever it is full,
+            so appending costs amortized constant time.
+        """
+        self.path = path
+        self.header_path = f"{path}.json"
+        if resume:
+            with open(self.header_path, 'r') as header_file:
+                saved_header = json.load(header_file)
+            if saved_header != header:
+                raise ValueError(f"Cannot resume {path}: it was created with "
+                                 f"different settings: {saved_header}.")
+            self.rows = np.lib.format.open_memmap(path, mode='r+')
+            self.count = count_points(self.rows)
+            return
+        if os.path.exists(path) and not overwrite:
+            raise FileExistsError(f"{path} exists. Pass --resume to continue "
+                                  f"it or --overwrite to replace it.")
+        with open(self.header_path, 'w') as header_file:
+            json.dump(header, header_file, indent=2)
+        self.rows = allocate_rows(path, capacity)
+        self.count = 0
+
+    def append(self, power, freq, watts):
+        """Store one measurement."""
+        if self.count == len(self.rows):
+            self._grow()
+        self.rows[self.count] = (power, freq, watts)
+        self.count += 1
+
+    def _grow(self):
+        """Copy the rows into a file with twice as many rows."""
+        tmp_path = f"{self.path}.tmp.npy"
+        rows = allocate_rows(tmp_path, len(self.rows)
+                             + max(len(self.rows), STORE_CHUNK_POINTS))
+        rows[:self.count] = self.rows[:self.count]
+        rows.flush()
+        del rows, self.rows
+        os.replace(tmp_path, self.path)
+        self.rows = np.lib.format.open_memmap(self.path, mode='r+')
+
+    def points(self):
+        """Return a view of the stored rows."""
+        return self.rows[:self.count]
+
+    def close(self):
+        """Write the stored rows to disk."""
+        self.rows.flush()
+
+
+def allocate_rows(path, capacity):
+    """Create a .npy file of capacity empty (NaN) rows."""
+    rows = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                     shape=(capacity, 3))
+    rows[:] = np.nan
+    return rows
+
+
+def count_points(rows):
+    """Return the number of leading rows that hold a full measurement."""
+    empty = np.flatnonzero(np.isnan(rows).any(axis=1))
+    return int(empty[0]) if len(empty) else len(rows)
+
+
+def load_points(path):
+    """Load the measurements of a .npy output file without copying them.
+
+    :return: a read-only (N, 3) array view of power [dBm], frequency [MHz],
+        and watts [w] rows and the dict of sweep arguments.
+    """
+    rows = np.load(path, mmap_mode='r')
+    with open(f"{path}.json", 'r') as header_file:
+        header = json.load(header_file)
+    return rows[:count_points(rows)], header
+
+
+class Sampler:
+    """Measure the output power at aotf settings, record every measurement,
+    and keep track of the best one.
+
+    Measurements are recorded on a worker thread so that writing the output
+    overlaps with setting up and measuring the next point. Call
+    :meth:`close` to wait for the recording to finish.
+    """
+
+    def __init__(self, aotf, meter, channel, validate=False, store=None,
+                 settle_tolerance=0.0,
+                 max_settle_time_s=MEASUREMENT_SETTLING_TIME_S,
+                 progress=None, min_settle_time_s=MIN_SETTLE_TIME_S):
+        """Start with no measurements.
+
+        :param store: a :class:`CsvStore` or :class:`NpyStore` to write
+            measurements to, or None.
+        :param settle_tolerance: see :func:`read_settled`.
+        :param max_settle_time_s: longest wait for a reading to settle.
+        :param progress: callable to call after every new measurement, or
+            None.
+        :param min_settle_time_s: wait after setting the aotf before the
+            first reading.
+        """
+        self.aotf = aotf
+        self.meter = meter
+        self.channel = channel
+        self.validate = validate
+        self.store = store
+        self.settle_tolerance = settle_tolerance
+        self.max_settle_time_s = max_settle_time_s
+        self.min_settle_time_s = min_settle_time_s
+        self.progress = progress
+        self._recorder = ThreadPoolExecutor(max_workers=1)
+        self.power_xy = []
+        self.freq_xy = []
+        self.watts_xy = []
+        self.max_watts = 0
+        self.argmax_power = 0
+        self.argmax_freq = 0
+        self._power = None  # Power [dBm] currently set on the aotf.
+        # Searches may revisit settings; only measure them once.
+        self._measured = {}
+
+    def measure(self, power, freq):
+        """Return the output power [w] at a power [dBm] & frequency [MHz]."""
+        # Rounded to the resolution of the device.
+        key = (round(power, 2), round(freq, 3))
+        if key in self._measured:
+            return self._measured[key]
+        settings = {'freq': freq}
+        if power != self._power:
+            settings['dbm'] = power
+        # Set both with a single write.
+        self.aotf.apply({self.channel: settings}, validate=self.validate)
+        self._power = power
+        watts = read_settled(self.meter, self.settle_tolerance,
+                             self.max_settle_time_s, self.min_settle_time_s)
+        self._measured[key] = watts
+        self._recorder.submit(self.record, power, freq, watts)
+        if self.progress is not None:
+            self.progress()
+        return watts
+
+    def best(self):
+        """Return the power [dBm] & frequency [MHz] of the highest output
+        measured so far."""
+        return max(self._measured, key=self._measured.get)
+
+    def close(self):
+        """Wait for every measurement to be recorded."""
+        self._recorder.shutdown(wait=True)
+
+    def preload(self, points):
+        """Add measurements from a previous run so that they are not taken
+        again."""
+        for power, freq, watts in points:
+            self._measured[(round(power, 2), round(freq, 3))] = watts
+            self.record(power, freq, watts, store=False)
+
+    def record(self, power, freq, watts, store=True):
+        """Keep one measurement and write it to the store."""
+        self.power_xy.append(power)
+        self.freq_xy.append(freq)
+        self.watts_xy.append(watts)
+        if store and self.store is not None:
+            self.store.append(power, freq, watts)
+        if watts > self.max_watts:  # Save best-so-far measurement.
+            self.max_watts = watts
+            self.argmax_power = power
+            self.argmax_freq = freq
+
+
+def axis(start, stop, step):
+    """Return evenly spaced points from start to stop (inclusive) that are
+    at most step apart."""
+    num = int(np.ceil((stop - start) / step - 1e-9)) + 1
+    return np.linspace(start, stop, max(num, 1))
+
+
+def zoom(center, spacing, bounds):
+    """Return the window one spacing either side of center within bounds."""
+    return max(center - spacing, bounds[0]), min(center + spacing, bounds[1])
+
+
+def grid_search(measure, min_power, max_power, power_step,
+                min_freq, max_freq, freq_step, show_progress=True):
+    """Measure every point of the full grid.
+
+    :param show_progress: if False, do not draw progress bars.
+    """
+    for power in tqdm(np.arange(min_power, max_power, power_step),
+                      desc="Power Sweep:", leave=False,
+                      disable=not show_progress):
+        for freq in tqdm(np.arange(min_freq, max_freq, freq_step),
+                         desc="Frequency Sweep:", leave=False,
+                         disable=not show_progress):
+            measure(power, freq)
+
+
+def refine_search(measure, min_power, max_power, power_step,
+                  min_freq, max_freq, freq_step,
+                  coarse_power_step, coarse_freq_step, show_progress=True):
+    """Measure a coarse grid, then repeatedly measure a finer grid around
+    the best point until it is located within power_step & freq_step.
+
+    Each level halves the grid spacing within a window one (old) spacing
+    either side of the best point, so every level after the first costs at
+    most 5 x 5 points.
+
+    :param show_progress: if False, do not draw progress bars.
+    :return: the best power [dBm] and frequency [MHz].
+    """
+    power_bounds = power_window = (min_power, max_power)
+    freq_bounds = freq_window = (min_freq, max_freq)
+    power_spacing = max(coarse_power_step, power_step)
+    freq_spacing = max(coarse_freq_step, freq_step)
+    level = 0
+    while True:
+        powers = axis(*power_window, power_spacing)
+        freqs = axis(*freq_window, freq_spacing)
+        _, best_power, best_freq = max(
+            (measure(power, freq), power, freq)
+            for power in tqdm(powers, desc=f"Level {level}:", leave=False,
+                              disable=not show_progress)
+            for freq in freqs)
+        if power_spacing <= power_step and freq_spacing <= freq_step:
+            return best_power, best_freq
+        power_window = zoom(best_power, power_spacing, power_bounds)
+        freq_window = zoom(best_freq, freq_spacing, freq_bounds)
+        power_spacing = max(power_spacing / 2, power_step)
+        freq_spacing = max(freq_spacing / 2, freq_step)
+        level += 1
+
+
+def golden_section_max(func, start, stop, tolerance):
+    """Return the argmax, within tolerance, of a function that is unimodal
+    on [start, stop]."""
+    a, b = start, stop
+    c = b - INV_GOLDEN_RATIO * (b - a)
+    d = a + INV_GOLDEN_RATIO * (b - a)
+    fc, fd = func(c), func(d)
+    while b - a > tolerance:
+        if fc > fd:
+            b, d, fd = d, c, fc
+            c = b - INV_GOLDEN_RATIO * (b - a)
+            fc = func(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + INV_GOLDEN_RATIO * (b - a)
+            fd = func(d)
+    return (a + b) / 2
+
+
+def golden_search(measure, min_power, max_power, power_step,
+                  min_freq, max_freq, freq_step,
+                  coarse_power_step, coarse_freq_step, show_progress=True):
+    """Find the best frequency at max power, then the best power at that
+    frequency.
+
+    The frequency is located with a coarse scan followed by a golden-section
+    search in the bracket around the best coarse point, which assumes that
+    the coarse step is narrower than the transmission peak. The power is
+    located with a 1-D :func:`refine_search`.
+
+    :param show_progress: if False, do not draw progress bars.
+    :return: the best power [dBm] and frequency [MHz].
+    """
+    freq_spacing = max(coarse_freq_step, freq_step)
+    _, best_freq = max(
+        (measure(max_power, freq), freq)
+        for freq in tqdm(axis(min_freq, max_freq, freq_spacing),
+                         desc="Frequency Scan:", leave=False,
+                         disable=not show_progress))
+    best_freq = golden_section_max(
+        lambda freq: measure(max_power, freq),
+        *zoom(best_freq, freq_spacing, (min_freq, max_freq)), freq_step)
+    best_power, _ = refine_search(measure, min_power, max_power, power_step,
+                                  best_freq, best_freq, freq_step,
+                                  coarse_power_step, freq_step,
+                                  show_progress)
+    return best_power, best_freq
+
+
+def update_calibration(path, channel, points):
+    """Add (or replace) the lookup table of one channel in a calibration
+    file.
+
+    :param points: rows of (power [dBm], frequency [MHz], watts [w]).
+    """
+    calibration = Calibration.load(path) if os.path.exists(path) \
+        else Calibration()
+    calibration[channel] = ChannelCalibration.from_points(points)
+    calibration.save(path)
+
+
+SEARCHES = {'grid': grid_search, 'refine': refine_search,
+            'golden': golden_search}
+
+
+def run_search(sampler, search, min_power, max_power, power_step,
+               min_freq, max_freq, freq_step, coarse_power_step=2.0,
+               coarse_freq_step=0.5, power_curve=False, show_progress=True):
+    """Measure with a sampler according to one of the SEARCHES.
+
+    :param power_curve: if True, also measure the full power curve at the
+        best frequency, as needed for a calibration lookup table.
+    :param show_progress: if False, do not draw progress bars.
+    """
+    search_args = [min_power, max_power, power_step,
+                   min_freq, max_freq, freq_step]
+    if search != 'grid':
+        search_args += [coarse_power_step, coarse_freq_step]
+    SEARCHES[search](sampler.measure, *search_args,
+                     show_progress=show_progress)
+    if power_curve:
+        _, best_freq = sampler.best()
+        for power in tqdm(axis(min_power, max_power, power_step),
+                          desc="Power Curve:", leave=False,
+                          disable=not show_progress):
+            sampler.measure(power, best_freq)
+
+
+def main():
+    """Run a calibration sweep from the command line."""
     description = """With a Thorlabs PM100 power meter installed at the output
-        of the aotf, run a grid sweep of input commands over the specified
-        frequency and power range, save the output to a CSV, plot the output,
-        and print the settings that produce the maximum power output."""
+        of the aotf, sample input commands over the specified frequency and
+        power range, save the output to a CSV, plot the output, and print the
+        settings that produce the maximum power output."""
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument("channel", type=int, default=1,
                         help="the desired aotf channel.")
@@ -61,6 +523,33 @@ if __name__ == "__main__":
                         help="minimum power [dBm] to stop the sweep.")
     parser.add_argument("power_step", type=float, default=0.1,
                         help="power step size increment.")
+    parser.add_argument("--search", choices=SEARCHES, default="grid",
+                        help="grid: measure every point of the grid. "
+                             "refine: measure a coarse grid, then finer grids "
+                             "around the best point until it is located "
+                             "within the step sizes. golden: locate the best "
+                             "frequency at max power with a coarse scan and "
+                             "a golden-section search, then the best power "
+                             "at that frequency.")
+    parser.add_argument("--coarse_freq_step", type=float, default=0.5,
+                        help="frequency step [MHz] of the first refine or "
+                             "golden level. Must be narrower than the "
+                             "transmission peak.")
+    parser.add_argument("--coarse_power_step", type=float, default=2.0,
+                        help="power step [dBm] of the first refine or golden "
+                             "level.")
+    parser.add_argument("--settle_tolerance", type=float, default=0.01,
+                        help="accept a reading once successive readings "
+                             "agree within this fraction. 0 always waits the "
+                             "max settle time.")
+    parser.add_argument("--max_settle_time", type=float,
+                        default=MEASUREMENT_SETTLING_TIME_S,
+                        help="longest wait [s] for a reading to settle.")
+    parser.add_argument("--min_settle_time", type=float,
+                        default=MIN_SETTLE_TIME_S,
+                        help="wait [s] after changing the aotf settings "
+                             "before the first reading. Must cover the power "
+                             "meter's update period.")
     parser.add_argument("--validate", default=False, action="store_true",
                         help="if True, check the hardware device to ensure "\
                              "that the desired settings have been set. " \
@@ -71,9 +560,20 @@ if __name__ == "__main__":
     parser.add_argument("--pm100_port", type=str, default="/dev/usbtmc0",
                         help="name of the PM100 device as it appears on the pc.")
     parser.add_argument("--filename", type=str, default="data.csv",
-                        help="the name of the CSV output file.")
+                        help="the name of the output file. Files ending in "
+                             ".npy are written as memory-mapped binary rows "
+                             "that can be resumed; others as CSV.")
     parser.add_argument("--overwrite", default=False, action="store_true",
                         help="allow overwriting data in preexisting output file.")
+    parser.add_argument("--resume", default=False, action="store_true",
+                        help="continue a sweep with the same settings that "
+                             "stopped early, skipping the points already in "
+                             "the .npy output file.")
+    parser.add_argument("--calibration", type=str, default=None,
+                        help="JSON calibration file to add (or update) this "
+                             "channel's output power lookup table in. The "
+                             "power curve at the best frequency is measured "
+                             "in full after the search.")
     parser.add_argument("--console_output", default=True,
                         help="whether or not to print to the console.")
     args = parser.parse_args()
@@ -82,92 +582,71 @@ if __name__ == "__main__":
         print(f"{arg}: {getattr(args, arg)}")
     print()
 
-    # Setup Thorlabs power meter
-    meter = None
-    if PLATFORM == 'win32':
-        # Duplicate the function signature of the USBTMC module.
-        # FIXME: put the connection attempt in a try-except with software link:
-        # https://www.thorlabs.com/software_pages/ViewSoftwarePage.cfm?Code=OPM
-        resource_name = create_string_buffer(1024)
-        meter = MyTLPM()
-        deviceCount = c_uint32()
-        meter.findRsrc(byref(deviceCount))  # We need to call this first.
-        meter.getRsrcName(c_int(0), resource_name)  # get name of first device.
-        meter.open(resource_name, c_bool(True), c_bool(True))
-        meter.setPowerUnit(c_int16(0))  # 0 --> watts
-        set_wavelength = c_double(0)
-        meter.getWavelength(c_int16(tlpm_mod.TLPM_ATTR_SET_VAL), byref(set_wavelength))
-        print(f"PM100 wavelength currently set to {set_wavelength.value}[nm].")
-        if abs(set_wavelength.value - args.wavelength) < 0.001:
-            print("PM100 already at correct wavelength. Skipping.")
-        else:
-            time.sleep(1.0) # Sleeping is necessary here.
-            # Otherwise reading current setting will change the set value.
-            print(f"Setting PM100 wavelength to {args.wavelength}[nm].")
-            meter.setWavelength(c_double(args.wavelength))
+    # Open the output before touching any hardware.
+    if args.filename.endswith('.npy'):
+        capacity = STORE_CHUNK_POINTS
+        if args.search == 'grid':  # Preallocate every point.
+            capacity = len(np.arange(args.min_power, args.max_power,
+                                     args.power_step)) \
+                * len(np.arange(args.min_freq, args.max_freq, args.freq_step))
+        store = NpyStore(args.filename,
+                         {arg: getattr(args, arg) for arg in HEADER_ARGS},
+                         capacity, args.resume, args.overwrite)
+    elif args.resume:
+        parser.error("--resume requires a .npy output file.")
     else:
-        inst = USBTMC(device=args.pm100_port)
-        meter = ThorlabsPM100(inst=inst)
-        meter.sense.correction.wavelength = args.wavelength
+        store = CsvStore(args.filename)
 
-    # for i in range(10):
-    #     print(f"value from power meter is: {meter.read}")
-    #     time.sleep(0.5)
+    # Setup Thorlabs power meter and aotf.
+    meter = connect_power_meter(args.wavelength, args.pm100_port)
+    aotf = connect_aotf(args.aotf_port, args.channel)
 
-    # Setup aotf.
-    aotf = MPDS(args.aotf_port)
-    aotf.set_blanking_mode(BlankingMode.INTERNAL)
-    aotf.set_channel_input_mode(args.channel, InputMode.INTERNAL)
-    aotf.enable_channel(args.channel)
-    #print(aotf.get_lines_status())
-
-    # Containers.
-    power_xy = []
-    freq_xy = []
-    watts_xy = []
-    max_watts = 0
-    argmax_power = 0
-    argmax_freq = 0
     # Take measurements with progress bar.
     try:
-        with open(args.filename, 'w') as the_file:
-            the_file.write("power [dbm], frequency [MHz], watts [w]\n")
-            try:
-                for power in tqdm(np.arange(args.min_power, args.max_power, args.power_step),
-                        desc="Power Sweep:", leave=False):
-                    aotf.set_power_dbm(args.channel, power, validate=args.validate)
-                    for freq in tqdm(np.arange(args.min_freq, args.max_freq, args.freq_step),
-                            desc="Frequency Sweep:", leave=False):
-                        aotf.set_frequency(args.channel, freq, validate=args.validate)
-                        time.sleep(MEASUREMENT_SETTLING_TIME_S)
-                        watts = meter.read
-                        power_xy.append(power)
-                        freq_xy.append(freq)
-                        watts_xy.append(watts)
-                        the_file.write(f'{power}, {freq}, {watts}\n')
-                        if watts > max_watts:  # Save best-so-far measurement.
-                            max_watts = watts
-                            argmax_power = power
-                            argmax_freq = freq
-            except Exception as e:  # Exception catch-all so that we save the data.
-                print(e)
-                import traceback
-                traceback.print_exc()
+        sampler = Sampler(aotf, meter, args.channel, args.validate, store,
+                          args.settle_tolerance, args.max_settle_time,
+                          min_settle_time_s=args.min_settle_time)
+        if args.resume:
+            sampler.preload(store.points())
+            print(f"Resuming after {len(sampler.watts_xy)} measurements.")
+        try:
+            run_search(sampler, args.search, args.min_power,
+                       args.max_power, args.power_step, args.min_freq,
+                       args.max_freq, args.freq_step, args.coarse_power_step,
+                       args.coarse_freq_step, args.calibration is not None)
+        except Exception as e:  # Exception catch-all so that we save the data.
+            print(e)
+            import traceback
+            traceback.print_exc()
+        finally:
+            sampler.close()
     finally:
+        store.close()
         print("Turning off aotf.")
         aotf.disable_channel(args.channel)
         if PLATFORM == 'win32':
             print("closing connection to power meter.")
             meter.close()
     print(f"The following settings: "
-          f"({argmax_power:.2f}[dBm], {argmax_freq:.3f}[MHz]) "
-          f"result in the highest measured output power of {max_watts:.6f}[w].")
+          f"({sampler.argmax_power:.2f}[dBm], {sampler.argmax_freq:.3f}[MHz]) "
+          f"result in the highest measured output power of "
+          f"{sampler.max_watts:.6f}[w] after {len(sampler.watts_xy)} "
+          f"measurements.")
+    if args.calibration is not None:
+        update_calibration(args.calibration, args.channel,
+                           np.column_stack((sampler.power_xy, sampler.freq_xy,
+                                            sampler.watts_xy)))
+        print(f"Saved the channel {args.channel} calibration to "
+              f"{args.calibration}.")
     # Plot the results.
     fig = plt.figure()
     ax = plt.axes(projection ='3d')
-    ax.scatter(power_xy, freq_xy, watts_xy)
+    ax.scatter(sampler.power_xy, sampler.freq_xy, sampler.watts_xy)
     ax.set_xlabel('power [dBm]')
     ax.set_ylabel('frequency [MHz]')
     ax.set_zlabel('watts');
     plt.show()
 
+
+if __name__ == "__main__":
+    main()
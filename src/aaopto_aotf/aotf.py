@@ -1,13 +1,23 @@
 """Python driver for an AA OptoElectronics AOTF device."""
 
 import logging
+import threading
 import time
 
-from parse import parse
 from serial import Serial, SerialException
+from aaopto_aotf.descriptors import DescriptorCache
 from aaopto_aotf.device_codes import *
-from functools import wraps
-from typing import Union
+from aaopto_aotf.io_worker import (PRIORITY_HIGH, PRIORITY_LOW,
+                                   PRIORITY_NORMAL, IOWorker)
+from aaopto_aotf.reply_parsers import (is_preamble_line,
+                                       parse_blanking_status,
+                                       parse_channel_status, parse_line_status)
+from aaopto_aotf.shadow_state import ShadowState
+from aaopto_aotf.stats import (CommandStats, ReplyDeadlines, bucket_ceil,
+                               command_root)
+from aaopto_aotf.telemetry import StatusPoller
+from functools import lru_cache, wraps
+from typing import NamedTuple, Optional, Union
 
 
 def channel_range_check(func):
@@ -20,21 +30,449 @@ def channel_range_check(func):
     return inner
 
 
+@lru_cache(maxsize=4096)
+def encode_cmd(template: str, *args) -> bytes:
+    """Format a command template and encode it for the wire.
+
+    Results are cached so that repeated commands (e.g: toggling a channel or
+    revisiting a frequency) are only formatted and encoded once.
+
+    :param template: a :obj:`~Cmds` or :obj:`~Queries` value.
+    :param args: the arguments to format into the template.
+    """
+    return template.format(*args).encode('ascii')
+
+
+EOL_BYTES = EOL.encode('ascii')
+CHANNEL_PREFIX_BYTES = CmdRoots.CHANNEL_PREFIX.value.encode('ascii')
+# Housekeeping queries yield to commands when the I/O worker is in use.
+LOW_PRIORITY_QUERIES = frozenset(
+    query.value.encode('ascii')
+    for query in (Queries.LINES_STATUS, Queries.PRODUCT_ID))
+
 MAX_POWER_DBM = 22.0
 
 BAUDRATE = 57600
+# Bits on the wire per byte with 8N1 framing.
+BITS_PER_BYTE = 10
 TIMEOUT = 0.5
 
 RESET_BOOT_TIME_S = 0.005
+# Bound on how long a reset device may take to reply to queries again.
+RESET_READY_TIMEOUT_S = 1.0
+
+# (apply() key, settings cache field) of every channel setting in a profile.
+PROFILE_FIELDS = (('freq', 'freq'), ('dbm', 'power'), ('enabled', 'state'),
+                  ('mode', 'mode'))
+# Differences below the device resolution do not need to be sent.
+PROFILE_TOLERANCES = {'freq': 0.0005, 'dbm': 0.05}
+
+# Input that ends a reply.
+REPLY_TERMINATORS = (EOL_BYTES, b"?")
+
+
+class ReplyTimeoutError(TimeoutError):
+    """The device did not finish a reply within its deadline."""
+
+
+class DesyncError(ValueError):
+    """A reply does not belong to the message that was sent."""
+
+
+class EncodedSettings(NamedTuple):
+    """Settings of :meth:`MPDS.apply` encoded ahead of time with
+    :meth:`MPDS.encode_apply`."""
+    settings: dict
+    data: bytes  # Every message, as written.
+    msg_channels: list  # The channel of each message.
+    validated_channels: list  # Channels whose status queries end `data`.
+
+
+class BaseMPDS:
+    """I/O-free half of the driver shared by :class:`MPDS` and
+    :class:`~aaopto_aotf.async_aotf.AsyncMPDS`: it encodes commands, parses
+    replies, and tracks the device settings."""
+
+    def __init__(self, name: str, max_age: Optional[float] = None):
+        """Create the logger and an empty settings cache.
+
+        :param name: device name (e.g: the serial port) used for logging.
+        :param max_age: age in [s] beyond which cached settings are re-read
+            from the hardware. If None, getters are always served from the
+            cache once it holds a value, since every setting is tracked as it
+            is written.
+        """
+        self._cache = ShadowState(max_age)
+        # Set `command_stats.hook` to receive every transaction.
+        self.command_stats = CommandStats()
+        # A :class:`~aaopto_aotf.calibration.Calibration` for
+        # :meth:`MPDS.set_output_power`.
+        self.calibration = None
+        # A :class:`~aaopto_aotf.tuning.TuningCurve` of the crystal for
+        # :meth:`MPDS.set_wavelengths`.
+        self.tuning = None
+        self.log = logging.getLogger(f"{__name__}.{name}")
+        self.num_channels = None
+        self._pll_switch_cmds = {}
+
+    def _encode_pll_switch_cmds(self):
+        """Encode channel on/off, the most latency-critical command, once."""
+        self._pll_switch_cmds = {
+            (channel, state): Cmds.PLL_SWITCH.value.format(
+                channel, state.value).encode('ascii')
+            for channel in range(1, self.num_channels + 1)
+            for state in OutputState}
+
+    def _check_frequency(self, frequency: float, actual_freq: float):
+        """Raise a ValueError if the actual frequency does not match."""
+        # Compare rounded numbers.
+        if abs(actual_freq - round(frequency, 3)) > 0.0005:
+            raise ValueError(f"Error: desired frequency is {frequency} "
+                             f"[MHz] but actual frequency is "
+                             f"{actual_freq} [MHz].")
+
+    def _check_power(self, dbm: float, actual_power: float):
+        """Raise a ValueError if the actual power does not match."""
+        # Compare rounded numbers.
+        if abs(actual_power - round(dbm, 1)) > 0.05:
+            raise ValueError(f"Error: desired power is {dbm}[dBm] "
+                             f"but actual power is "
+                             f"{actual_power} [dBm].")
+
+    def _check_settings(self, channel: int, ch_settings: dict):
+        """Check the settings of one channel passed to :meth:`MPDS.apply`."""
+        if channel < 1 or channel > self.num_channels:
+            raise IndexError("Requested channel value is out of range.")
+        unknown = set(ch_settings) - {'freq', 'dbm', 'enabled', 'mode'}
+        if unknown:
+            raise KeyError(f"Unknown channel settings: {sorted(unknown)}.")
+        dbm = ch_settings.get('dbm')
+        if dbm is not None and (dbm > MAX_POWER_DBM or dbm < 0):
+            raise IndexError("Specified fine power [dBm] is out of range.")
+
+    def _encode_apply(self, settings: dict, validate: bool):
+        """Check and encode the settings passed to :meth:`MPDS.apply`.
+
+        :return: the encoded messages, the channel of each message, and the
+            channels whose status queries were appended to them for
+            validation.
+        """
+        msgs = []
+        msg_channels = []
+        for channel, ch_settings in settings.items():
+            self._check_settings(channel, ch_settings)
+            dbm = ch_settings.get('dbm')
+            enabled = ch_settings.get('enabled')
+            # Switch off first and on last so that the output never runs with
+            # a mix of old and new settings.
+            if enabled is False:
+                msgs.append(self._pll_switch_cmds[(channel, OutputState.OFF)])
+            if ch_settings.get('mode') is not None:
+                msgs.append(encode_cmd(Cmds.DRIVER_MODE.value, channel,
+                                       ch_settings['mode'].value))
+            if ch_settings.get('freq') is not None:
+                msgs.append(encode_cmd(Cmds.FREQUENCY_ADJUST.value, channel,
+                                       ch_settings['freq']))
+            if dbm is not None:
+                msgs.append(encode_cmd(Cmds.FINE_POWER_ADJUST.value, channel,
+                                       dbm))
+            if enabled is True:
+                msgs.append(self._pll_switch_cmds[(channel, OutputState.ON)])
+            msg_channels.extend([channel] * (len(msgs) - len(msg_channels)))
+        validated_channels = []
+        if validate:
+            validated_channels = [ch for ch, ch_settings in settings.items()
+                                  if ch_settings.get('freq') is not None
+                                  or ch_settings.get('dbm') is not None]
+            msgs.extend(encode_cmd(Queries.CHANNEL_SPECIFIC_STATUS.value, ch)
+                        for ch in validated_channels)
+            msg_channels.extend(validated_channels)
+        return msgs, msg_channels, validated_channels
+
+    def _apply_replies(self, settings: dict, msg_channels: list,
+                       validated_channels: list, replies: list):
+        """Update the cache from the replies to :meth:`MPDS.apply` and
+        validate the settings against the trailing status replies.
+
+        :param msg_channels: the channel of each message sent.
+        :raises DesyncError: if a reply is for another channel than its
+            message. The cached settings of every channel in `settings` are
+            dropped first.
+        """
+        num_cmds = len(replies) - len(validated_channels)
+        try:
+            self._cache_apply_replies(settings, msg_channels[:num_cmds],
+                                      replies[:num_cmds])
+            statuses = [self._parse_channel_status(reply)
+                        for reply in replies[num_cmds:]]
+            self._check_reply_channels(
+                [status.channel for status in statuses], validated_channels)
+        except DesyncError:
+            for channel in settings:
+                self._cache.invalidate(channel)
+            raise
+        errors = []
+        for channel, freq, power, _ in statuses:
+            desired_freq = settings[channel].get('freq')
+            if desired_freq is not None \
+                    and abs(freq - round(desired_freq, 3)) > 0.0005:
+                errors.append(f"channel {channel}: desired frequency is "
+                              f"{desired_freq} [MHz] but actual frequency "
+                              f"is {freq} [MHz].")
+            desired_power = settings[channel].get('dbm')
+            if desired_power is not None \
+                    and abs(power - round(desired_power, 1)) > 0.05:
+                errors.append(f"channel {channel}: desired power is "
+                              f"{desired_power}[dBm] but actual power is "
+                              f"{power} [dBm].")
+        if errors:
+            raise ValueError("Error: " + " ".join(errors))
+
+    def _cache_apply_replies(self, settings: dict, msg_channels: list,
+                             replies: list):
+        """Cache the settings reported by the replies to the commands sent by
+        :meth:`MPDS.apply`, given the channel of each command.
+
+        Requested frequencies, powers, and output states are only cached as
+        reported by the device, since it may clamp or round them. Those of a
+        channel whose latest command reply cannot be parsed are dropped from
+        the cache instead.
+        """
+        reported = {}  # {channel: whether its latest reply was parsed}
+        for channel, reply in zip(msg_channels, replies):
+            try:
+                status = parse_channel_status(reply)
+            except ValueError:
+                reported[channel] = False
+                continue
+            self._check_reply_channels([status.channel], [channel])
+            self._cache.update(channel, freq=status.freq, power=status.power,
+                               state=status.state)
+            reported[channel] = True
+        for channel, ch_settings in settings.items():
+            if ch_settings.get('mode') is not None:
+                self._cache.update(channel, mode=ch_settings['mode'])
+            if not reported.get(channel, False):
+                self._cache.invalidate(channel, *(
+                    field for key, field in PROFILE_FIELDS
+                    if key != 'mode' and ch_settings.get(key) is not None))
+
+    def _check_reply_channels(self, channels: list, expected: list):
+        """Raise a DesyncError if replies are not for the expected channels,
+        in order."""
+        if channels != expected:
+            raise DesyncError(f"Received the status of channels {channels} "
+                              f"instead of {expected}.")
+
+    def _cache_channel_reply(self, channel: int, reply: str, field: str):
+        """Cache the settings reported by the reply to a channel command.
+
+        If the reply cannot be parsed, `field` (the setting the command
+        wrote) is dropped from the cache instead of assuming the requested
+        value, which the device may have clamped or rounded.
+
+        :raises DesyncError: if the reply is for another channel.
+        """
+        try:
+            status = self._parse_channel_status(reply)
+        except ValueError:
+            self._cache.invalidate(channel, field)
+            return
+        if status.channel != channel:
+            self._cache.invalidate(channel, field)
+            raise DesyncError(f"Received the status of channel "
+                              f"{status.channel} instead of {channel}.")
 
+    def _snapshot_from_cache(self, max_age: Optional[float]):
+        """Return the profile of the device from the cache, or None if any
+        setting is missing or stale. See :meth:`MPDS.snapshot`."""
+        snapshot = {}
+        for channel in range(1, self.num_channels + 1):
+            ch_settings = {key: self._cache.get(channel, field, max_age)
+                           for key, field in PROFILE_FIELDS}
+            if None in ch_settings.values():
+                return None
+            ch_settings['enabled'] = ch_settings['enabled'] == OutputState.ON
+            snapshot[channel] = ch_settings
+        blanking_mode = self._cache.get('blanking', 'mode', max_age)
+        if blanking_mode is None:
+            return None
+        snapshot['blanking'] = {'mode': blanking_mode}
+        return snapshot
 
-class MPDS:
+    def _diff_profile(self, profile: dict, current: dict):
+        """Return the settings of `profile` that differ from `current`.
 
-    def __init__(self, com_port: str):
+        Channel keys may be strings and settings may be enum values, as
+        after a round trip through JSON.
+
+        :return: the changed channel settings in the format of
+            :meth:`MPDS.apply` and the new blanking mode or None.
+        """
+        settings = {}
+        for key, target in profile.items():
+            if key == 'blanking':
+                continue
+            channel = int(key)
+            self._check_settings(channel, target)
+            changes = self._diff_channel(target, current[channel])
+            if changes:
+                settings[channel] = changes
+        blanking_mode = profile.get('blanking', {}).get('mode')
+        if blanking_mode is not None:
+            blanking_mode = BlankingMode(blanking_mode)
+            if blanking_mode == current['blanking']['mode']:
+                blanking_mode = None
+        return settings, blanking_mode
+
+    def _diff_channel(self, target: dict, current: dict):
+        """Return the settings of one channel that differ from `current`."""
+        changes = {}
+        for field, value in target.items():
+            if value is None:
+                continue
+            if field == 'mode':
+                value = InputMode(value)
+            elif field == 'enabled':
+                value = bool(value)
+            else:
+                value = float(value)
+                if abs(value - current[field]) <= PROFILE_TOLERANCES[field]:
+                    continue
+            if value != current[field]:
+                changes[field] = value
+        return changes
+
+    def get_external_input_voltage_range(self):
+        """Return the last voltage range set through this driver or None.
+
+        Note: the device cannot report this setting, so it is only known once
+        it has been set.
+        """
+        return self._cache.get('device', 'voltage_range', max_age=float('inf'))
+
+    def stats(self, reset: bool = False):
+        """Return call counts, bytes written and read, timeouts, unparsed
+        reply lines, desyncs, and latency histograms keyed by
+        :obj:`~CmdRoots`.
+
+        See :meth:`~aaopto_aotf.stats.CommandStats.snapshot`.
+
+        :param reset: if True, clear the statistics after reading them.
+        """
+        stats = self.command_stats.snapshot()
+        if reset:
+            self.command_stats.reset()
+        return stats
+
+    def _encode_output_power(self, channel: int, watts: float):
+        """Return the :meth:`MPDS.apply` settings that produce an output
+        power with the calibration, omitting the frequency if it is already
+        set."""
+        if self.calibration is None or channel not in self.calibration:
+            raise ValueError(f"Channel {channel} is not calibrated.")
+        table = self.calibration[channel]
+        settings = {'dbm': table.dbm(watts)}
+        if self._cache.get(channel, 'freq', float('inf')) \
+                != round(table.freq, 3):
+            settings['freq'] = table.freq
+        return settings
+
+    def _encode_wavelengths(self, wavelengths: dict):
+        """Return the :meth:`MPDS.apply` settings that tune channels to
+        wavelengths with :attr:`tuning`, omitting channels that are already
+        at their frequency."""
+        if self.tuning is None:
+            raise ValueError("No tuning curve is set.")
+        freqs = self.tuning.frequency_table(wavelengths)
+        return {channel: {'freq': freq} for channel, freq in freqs.items()
+                if self._cache.get(channel, 'freq', float('inf'))
+                != round(freq, 3)}
+
+    def _invalidate_modes(self):
+        """Force input and blanking modes to be read back from the hardware
+        rather than assume how they changed."""
+        for channel in range(1, self.num_channels + 1):
+            self._cache.invalidate(channel, 'mode')
+        self._cache.invalidate('blanking', 'mode')
+
+    def _parse_lines_status(self, reply: str):
+        """Parse a lines status reply and update the cache with it."""
+        settings = {}
+        reply_lines = reply.split(EOL)
+        if reply_lines == [""]:
+            return settings
+        # Parse channel settings.
+        # Note: may or may not start with 'Temp = 0\n\rAlim = 0\n\rUSB = 0'
+        for line in reply_lines[:-1]:
+            parsed = parse_line_status(line)
+            if parsed is None:
+                if is_preamble_line(line):
+                    continue
+                # throw out non-channel-related information.
+                self.log.warning("Could not parse: %s", line)
+                self.command_stats.record_unparsed(CmdRoots.LINES_STATUS)
+                continue
+            channel, ch_settings = parsed
+            settings[channel] = ch_settings
+            self._cache.update(channel, **ch_settings)
+        # Parse blanking settings.
+        parsed = parse_blanking_status(reply_lines[-1])
+        if parsed is None:
+            self.command_stats.record_unparsed(CmdRoots.LINES_STATUS)
+            raise ValueError(f"Could not parse: {reply_lines[-1]}")
+        name, blanking_settings = parsed
+        settings[name] = blanking_settings
+        self._cache.update(name, mode=blanking_settings['mode'])
+        return settings
+
+    def _parse_channel_status(self, reply: str):
+        """Parse a channel-specific status reply and update the cache."""
+        try:
+            status = parse_channel_status(reply)
+        except ValueError:
+            self.command_stats.record_unparsed(CmdRoots.CHANNEL_PREFIX)
+            raise
+        self._cache.update(status.channel, freq=status.freq,
+                           power=status.power, state=status.state)
+        return status
+
+
+class MPDS(BaseMPDS):
+
+    def __init__(self, com_port: str, max_age: Optional[float] = None,
+                 io_thread: bool = False, ser: Optional[Serial] = None,
+                 num_channels: Optional[int] = None,
+                 descriptor_cache: Optional[DescriptorCache] = None):
+        """Connect to the device and determine its channel count.
+
+        :param com_port: name of the serial port as it appears on the pc.
+        :param max_age: see :class:`BaseMPDS`.
+        :param io_thread: if True, all serial I/O runs on a dedicated
+            :class:`~aaopto_aotf.io_worker.IOWorker` thread that serves
+            channel on/off commands ahead of queued status queries. Useful
+            when several threads share the device. Otherwise, I/O runs on the
+            calling thread under a lock.
+        :param ser: an open serial-like transport to use instead of opening
+            `com_port` (e.g: :class:`~aaopto_aotf.emulator.EmulatedSerial`).
+            It must provide ``write()``, ``read()``, ``in_waiting``,
+            ``reset_input_buffer()``, ``reset_output_buffer()``, and
+            ``close()``.
+        :param num_channels: the channel count (1, 4, or 8) if known. Skips
+            all queries on connection; settings are read when first needed.
+        :param descriptor_cache: if `num_channels` is None, look the device
+            up by product ID in this cache, which only needs a short query,
+            and add it to the cache if it is missing.
+        """
+        super().__init__(com_port, max_age)
         self.ser = None
-        self.log = logging.getLogger(f"{__name__}.{com_port}")
+        self.poller = None
+        # Keeps the poller thread and callers from interleaving messages.
+        self._io_lock = threading.RLock()
+        self._io_worker = None
+        self._high_priority_cmds = frozenset()
         try:
-            self.ser = Serial(com_port, BAUDRATE, timeout=TIMEOUT)
+            self.ser = ser or Serial(com_port, BAUDRATE, timeout=TIMEOUT)
         except SerialException as e:
             self.log.error("Could not connect to AA OptoElectronics AOTF. "
                            "Is the device plugged in? Is another program "
@@ -42,17 +480,98 @@ class MPDS:
             raise
         self.ser.reset_input_buffer()
         self.ser.reset_output_buffer()
+        # Reused for every reply. Holds bytes read past the current reply.
+        self._rx_buffer = bytearray()
+        # Reply deadlines shrink from TIMEOUT as latencies are observed.
+        self._deadlines = ReplyDeadlines(TIMEOUT)
+        self._last_data = b""  # The message that the latest reply was for.
 
-        # Determine if MPDS has 1, 4, or 8 channels.
-        self.num_channels = len(self.get_lines_status()) - 1
+        if io_thread:
+            self._io_worker = IOWorker(f"MPDS I/O worker {com_port}")
+
+        self.num_channels = num_channels
+        if num_channels is None:
+            self.num_channels = self._count_channels(descriptor_cache)
+        self._encode_pll_switch_cmds()
+        self._high_priority_cmds = frozenset(self._pll_switch_cmds.values())
+
+    def _count_channels(self, descriptor_cache: Optional[DescriptorCache]):
+        """Determine if MPDS has 1, 4, or 8 channels."""
+        if descriptor_cache is None:
+            return len(self.get_lines_status()) - 1
+        product_id = self.get_product_id()
+        descriptor = descriptor_cache.get(product_id)
+        if descriptor is not None:
+            return descriptor['num_channels']
+        num_channels = len(self.get_lines_status()) - 1
+        descriptor_cache.put(product_id, num_channels=num_channels)
+        return num_channels
+
+    def close(self):
+        """Stop polling and I/O threads and close the serial port."""
+        self.stop_polling()
+        if self._io_worker is not None:
+            self._io_worker.stop()
+        self.ser.close()
+
+    def start_polling(self, interval_s: float = 0.1, capacity: int = 1024,
+                      lines_status: bool = True):
+        """Start reading the device status on a background thread.
+
+        Samples are kept in ``self.poller.telemetry`` and subscribers added
+        with ``self.poller.subscribe()`` are called when a setting changes.
+        Getters are served from the settings cache that the poller keeps
+        fresh, so consumers can share one poller instead of each querying the
+        device.
+
+        :param interval_s: time between the start of consecutive polls.
+        :param capacity: number of samples to keep.
+        :param lines_status: see :class:`~aaopto_aotf.telemetry.StatusPoller`.
+        :return: the :class:`~aaopto_aotf.telemetry.StatusPoller`.
+        """
+        if self.poller is not None:
+            raise RuntimeError("Status polling has already started.")
+        self.poller = StatusPoller(self, interval_s, capacity, lines_status)
+        self.poller.start()
+        return self.poller
+
+    def stop_polling(self):
+        """Stop the background status poller if it is running."""
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
 
     def reset(self):
         """Reset the device to external mode with stored parameter settings."""
         self._send(Cmds.RESET.value, reply=False)
-        # Wait a certain period before issuing subsequent commands;
-        # otherwise, the device will respond with EOL instead of the
-        # appropriate response.
+        # The device reloads the stored profile, so nothing cached holds.
+        self._cache.invalidate()
+        self._wait_until_ready()
+
+    def _wait_until_ready(self, timeout_s: float = RESET_READY_TIMEOUT_S):
+        """Wait for the device to boot, then probe it with back-off until it
+        replies with a well-formed status.
+
+        While it boots, the device responds with EOL instead of the
+        appropriate response.
+
+        :raises ReplyTimeoutError: if the device is not ready in time.
+        """
+        deadline = time.perf_counter() + timeout_s
+        # Probing sooner only costs round trips that the device answers with
+        # EOL.
         time.sleep(RESET_BOOT_TIME_S)
+        backoff_s = RESET_BOOT_TIME_S / 5
+        while True:
+            try:
+                self.get_channel_status(1)
+                return
+            except (ReplyTimeoutError, ValueError) as e:
+                if time.perf_counter() > deadline:
+                    raise ReplyTimeoutError(f"Device not ready {timeout_s} "
+                                            f"[s] after a reset.") from e
+            time.sleep(backoff_s)
+            backoff_s *= 2
 
     def save_profile(self):
         """Save current frequency and power settings for all channels to the
@@ -78,16 +597,12 @@ class MPDS:
             factory-set minimum and maximum frequencies.
         """
         # Must specify channel first.
-        msg = Cmds.FREQUENCY_ADJUST.value.format(channel, frequency)
-        self._send(msg)
+        reply = self._send(
+            encode_cmd(Cmds.FREQUENCY_ADJUST.value, channel, frequency))
+        self._cache_channel_reply(channel, reply, 'freq')
         if validate:
-            actual_freq = self.get_frequency(channel)
-            desired_freq = round(frequency, 3)
-            # Compare rounded numbers.
-            if abs(actual_freq - desired_freq) > 0.0005:
-                raise ValueError(f"Error: desired frequency is {frequency} "
-                                 f"[MHz] but actual frequency is "
-                                 f"{actual_freq} [MHz].")
+            actual_freq = self.get_channel_status(channel).freq
+            self._check_frequency(frequency, actual_freq)
 
     @channel_range_check
     def set_power_dbm(self, channel: int, dbm: float, validate: bool = True):
@@ -101,21 +616,140 @@ class MPDS:
         """
         if dbm > MAX_POWER_DBM or dbm < 0:
             raise IndexError("Specified fine power [dBm] is out of range.")
-        msg = Cmds.FINE_POWER_ADJUST.value.format(channel, dbm)
-        self._send(msg)
+        reply = self._send(
+            encode_cmd(Cmds.FINE_POWER_ADJUST.value, channel, dbm))
+        self._cache_channel_reply(channel, reply, 'power')
         if validate:
-            actual_power = self.get_power_dbm(channel)
-            desired_power = round(dbm, 1)
-            # Compare rounded numbers.
-            if abs(actual_power - desired_power) > 0.05:
-                raise ValueError(f"Error: desired power is {dbm}[dBm] "
-                                 f"but actual power is "
-                                 f"{actual_power} [dBm].")
+            actual_power = self.get_channel_status(channel).power
+            self._check_power(dbm, actual_power)
+
+    @channel_range_check
+    def set_output_power(self, channel: int, watts: float):
+        """Set the optical output power of a channel in [W] through
+        :attr:`calibration`, without reading anything back.
+
+        The RF power comes from the calibration table and the frequency is
+        set to the calibrated optimum if it is not already, in a single
+        write.
+
+        :raises ValueError: if the channel is not calibrated or the power is
+            outside of the calibrated range.
+        """
+        self.apply({channel: self._encode_output_power(channel, watts)},
+                   validate=False)
+
+    def set_wavelengths(self, wavelengths: dict, validate: bool = True):
+        """Tune many channels to optical wavelengths through :attr:`tuning`
+        with a single serial write.
+
+        :param wavelengths: dict of wavelengths in [nm] keyed by channel.
+        :param validate: see :meth:`apply`.
+        :raises ValueError: if no tuning curve is set.
+        """
+        self.apply(self._encode_wavelengths(wavelengths), validate)
+
+    def apply(self, settings: dict, validate: bool = True):
+        """Apply settings to many channels with a single serial write.
+
+        All commands are written at once and their replies are drained
+        afterwards, so the cost is roughly the wire time rather than one
+        round trip per setting.
+
+        :param settings: dict, keyed by channel index, of dicts with any of
+            the keys ``'freq'`` (frequency in [MHz]), ``'dbm'`` (power in
+            [dBm]), ``'enabled'`` (bool), and ``'mode'``
+            (:obj:`~InputMode`).
+        :param validate: if True, read back the frequency and power of every
+            channel in the same write and raise a ValueError listing every
+            setting that was not applied correctly.
+        """
+        self.apply_encoded(self.encode_apply(settings, validate))
+
+    def encode_apply(self, settings: dict, validate: bool = True):
+        """Check and encode the settings of :meth:`apply` ahead of time,
+        e.g: for software-timed playback with
+        :class:`~aaopto_aotf.sequencer.Sequencer`.
+
+        :return: an :class:`EncodedSettings` to pass to
+            :meth:`apply_encoded`.
+        """
+        msgs, msg_channels, validated_channels = self._encode_apply(
+            settings, validate)
+        return EncodedSettings(settings, b"".join(msgs), msg_channels,
+                               validated_channels)
+
+    def apply_encoded(self, encoded: EncodedSettings,
+                      priority: int = PRIORITY_NORMAL):
+        """Apply settings encoded with :meth:`encode_apply`. See
+        :meth:`apply`.
+
+        :param priority: see :mod:`~aaopto_aotf.io_worker`. Only used with
+            the I/O worker thread.
+        :return: the :func:`time.perf_counter` time of the write, after any
+            wait for the port, or None if there was nothing to send.
+        """
+        if not encoded.data:
+            return None
+        try:
+            write_time, replies = self._run_io(
+                priority, self._transact_batch, encoded.data,
+                len(encoded.msg_channels))
+        except ReplyTimeoutError:
+            # Any of the settings may have been applied.
+            for channel in encoded.settings:
+                self._cache.invalidate(channel)
+            raise
+        self._apply_replies(encoded.settings, encoded.msg_channels,
+                            encoded.validated_channels, replies)
+        return write_time
+
+    def snapshot(self, max_age: Optional[float] = None):
+        """Return the full configuration of the device.
+
+        Served from the settings cache when it is complete, otherwise read
+        with one lines status query.
+
+        :param max_age: see :meth:`get_frequency`.
+        :return: a dict keyed by channel index of dicts in the format of
+            :meth:`apply` holding every setting, plus a ``'blanking'`` entry
+            holding the :obj:`~BlankingMode` under ``'mode'``. It can be
+            stored as JSON and restored with :meth:`apply_profile`.
+        """
+        snapshot = self._snapshot_from_cache(max_age)
+        if snapshot is None:
+            self.refresh()
+            snapshot = self._snapshot_from_cache(float('inf'))
+            if snapshot is None:
+                raise ValueError("Could not read the full device "
+                                 "configuration.")
+        return snapshot
+
+    def apply_profile(self, profile: dict, validate: bool = True,
+                      save: bool = False, max_age: Optional[float] = None):
+        """Bring the device to a configuration, sending only the settings
+        that differ from the current ones.
+
+        :param profile: a (possibly partial) configuration in the format of
+            :meth:`snapshot`.
+        :param validate: see :meth:`apply`.
+        :param save: if True, save the result with :meth:`save_profile`.
+        :param max_age: age in [s] beyond which the current settings are
+            re-read before comparing. See :meth:`get_frequency`.
+        :return: the channel settings that were sent.
+        """
+        settings, blanking_mode = self._diff_profile(
+            profile, self.snapshot(max_age))
+        self.apply(settings, validate)
+        if blanking_mode is not None:
+            self.set_blanking_mode(blanking_mode)
+        if save:
+            self.save_profile()
+        return settings
 
     def _set_channel_output_state(self, channel: int, state: OutputState):
         """Turn on or off the specified channel output."""
-        msg = Cmds.PLL_SWITCH.value.format(channel, state.value)
-        self._send(msg)
+        self._send(self._pll_switch_cmds[(channel, state)])
+        self._cache.update(channel, state=state)
 
     @channel_range_check
     def enable_channel(self, channel: int):
@@ -127,8 +761,8 @@ class MPDS:
 
     @channel_range_check
     def set_channel_input_mode(self, channel: int, mode: InputMode):
-        msg = Cmds.DRIVER_MODE.value.format(channel, mode.value)
-        self._send(msg)
+        self._send(encode_cmd(Cmds.DRIVER_MODE.value, channel, mode.value))
+        self._cache.update(channel, mode=mode)
 
     def set_blanking_mode(self, mode: BlankingMode):
         """Set the blanking mode to internal or external.
@@ -146,11 +780,13 @@ class MPDS:
         """
         msg = Cmds.DRIVER_MODE.value.format(0, mode.value)
         self._send(msg)
+        self._cache.update('blanking', mode=mode)
 
     def set_external_input_voltage_range(self, vrange: VoltageRange):
         msg = Cmds.VOLTAGE_RANGE.value.format(vrange.value)
         # Note: this command does not issue any characters in response.
         self._send(msg, reply=False)
+        self._cache.update('device', voltage_range=vrange)
 
     def set_global_input_mode(self, mode: Union[InputMode, GlobalInputMode]):
         """Set both driver mode for all channels and blanking mode to internal
@@ -161,91 +797,334 @@ class MPDS:
         msg = Cmds.GLOBAL_DRIVER_MODE.value.format(mode.value)
         # Note: this command does not issue any characters in response.
         self._send(msg, reply=False)
+        self._invalidate_modes()
+
+    def refresh(self):
+        """Re-read all channel and blanking settings from the hardware."""
+        self.get_lines_status()
 
     def get_lines_status(self):
-        """Return the line status as a dictionary keyed by channel index."""
-        settings = {}
+        """Return the line status as a dictionary keyed by channel index.
+
+        Channel entries hold the frequency in [MHz], the power in [dBm], the
+        :obj:`~OutputState` and the :obj:`~InputMode`. The ``'blanking'``
+        entry holds the :obj:`~OutputState` and the :obj:`~BlankingMode`.
+        """
         reply = self._send(Queries.LINES_STATUS.value,
                            multiline_reply=True, read_until="?")
-        reply_lines = reply.split(EOL)
-        if reply_lines == [""]:
-            return settings
-        # TODO: return these as enums
-        # Parse channel settings.
-        template = "l{channel} F={freq:.3f} P={power:.3f} {state} {mode}"
-        # TODO: may or may not start with 'Temp = 0\n\rAlim = 0\n\rUSB = 0\'
-        for line in reply_lines[:-1]:
-            try:
-                ch_settings = parse(template, line).named
-                settings[int(ch_settings.pop('channel'))] = ch_settings
-            except AttributeError:
-                # throw out non-channel-related information.
-                self.log.warning(f"Could not parse: {line}")
-                pass
-        # Parse blanking settings.
-        template = "{blanking} {state} {mode}"
-        blanking_settings = parse(template, reply_lines[-1]).named
-        settings[blanking_settings.pop('blanking').lower()] = blanking_settings
-        return settings
+        return self._parse_lines_status(reply)
 
     @channel_range_check
-    def get_frequency(self, channel: int):
-        """Return the frequency in [MHz] of the current channel."""
-        reply = self._send(Queries.CHANNEL_SPECIFIC_STATUS.value.format(channel))
-        return parse(Replies.CHANNEL_SPECIFIC_STATUS, reply).fixed[1]
+    def get_channel_status(self, channel: int):
+        """Read the frequency, power, and output state of one channel from
+        the hardware with a single query.
+
+        :raises DesyncError: if the reply is for another channel.
+        :return: a :obj:`~ChannelStatus`.
+        """
+        reply = self._send(
+            encode_cmd(Queries.CHANNEL_SPECIFIC_STATUS.value, channel))
+        status = self._parse_channel_status(reply)
+        if status.channel != channel:
+            raise DesyncError(f"Received the status of channel "
+                              f"{status.channel} instead of {channel}.")
+        return status
+
+    def get_all_channel_status(self):
+        """Read the status of every channel from the hardware with a single
+        write of pipelined queries.
+
+        :return: a dict of :obj:`~ChannelStatus` keyed by channel index.
+        """
+        msgs = [encode_cmd(Queries.CHANNEL_SPECIFIC_STATUS.value, channel)
+                for channel in range(1, self.num_channels + 1)]
+        statuses = [self._parse_channel_status(reply)
+                    for reply in self._send_batch(msgs, PRIORITY_LOW)]
+        channels = [status.channel for status in statuses]
+        if channels != list(range(1, self.num_channels + 1)):
+            raise DesyncError(f"Received the status of channels {channels} "
+                              f"out of order.")
+        return {status.channel: status for status in statuses}
+
+    def _cached(self, key, field: str, max_age: Optional[float], read):
+        """Return a cached value; call `read` to fill the cache on a miss."""
+        value = self._cache.get(key, field, max_age)
+        if value is None:
+            read()
+            value = self._cache.get(key, field, max_age=float('inf'))
+        return value
+
+    @channel_range_check
+    def get_frequency(self, channel: int, max_age: Optional[float] = None):
+        """Return the frequency in [MHz] of the current channel.
+
+        :param max_age: age in [s] beyond which the cached value is re-read
+            from the hardware. If None, use the instance default. Use ``0`` to
+            force a hardware read.
+        """
+        return self._cached(channel, 'freq', max_age,
+                            lambda: self.get_channel_status(channel))
 
     @channel_range_check
-    def get_power_dbm(self, channel: int):
-        """return the fine power value of the current channel."""
-        reply = self._send(Queries.CHANNEL_SPECIFIC_STATUS.value.format(channel))
-        return parse(Replies.CHANNEL_SPECIFIC_STATUS, reply).fixed[2]
+    def get_power_dbm(self, channel: int, max_age: Optional[float] = None):
+        """return the fine power value of the current channel.
+
+        :param max_age: see :meth:`get_frequency`.
+        """
+        return self._cached(channel, 'power', max_age,
+                            lambda: self.get_channel_status(channel))
 
     @channel_range_check
-    def get_channel_input_mode(self, channel):
-        return InputMode[self.get_lines_status()['mode']]
+    def get_channel_input_mode(self, channel: int,
+                               max_age: Optional[float] = None):
+        """Return the input mode (internal or external) of the channel.
+
+        :param max_age: see :meth:`get_frequency`.
+        """
+        return self._cached(channel, 'mode', max_age, self.get_lines_status)
 
     @channel_range_check
-    def get_channel_output_state(self, channel: int):
-        """Get state of the pll for the current channel."""
-        reply = self._send(Queries.CHANNEL_SPECIFIC_STATUS.value.format(channel))
-        return bool(parse(Replies.CHANNEL_SPECIFIC_STATUS, reply).fixed[3])
+    def get_channel_output_state(self, channel: int,
+                                 max_age: Optional[float] = None):
+        """Get state of the pll for the current channel.
 
-    def get_blanking_mode(self):
-        """return the blanking mode (internal or external)."""
+        :param max_age: see :meth:`get_frequency`.
+        """
+        state = self._cached(channel, 'state', max_age,
+                             lambda: self.get_channel_status(channel))
+        return state == OutputState.ON
+
+    def get_blanking_mode(self, max_age: Optional[float] = None):
+        """return the blanking mode (internal or external).
+
+        :param max_age: see :meth:`get_frequency`.
+        """
         # This needs to be read from line status.
-        return BlankingMode[self.get_lines_status()['blanking']['mode']]
+        return self._cached('blanking', 'mode', max_age,
+                            self.get_lines_status)
 
     def get_product_id(self):
         """Get the product id."""
         reply = self._send(Queries.PRODUCT_ID, read_until="?",
                            reply_startswith_eol=False)
-        return parse(Replies.PRODUCT_ID, reply.rstrip()).fixed[0]
+        return reply.rstrip()
+
+    def _send_batch(self, msgs: list, priority: int = PRIORITY_NORMAL):
+        """Send several channel-prefixed messages with a single write and
+        return their one-line replies in order.
+
+        :param msgs: the messages (in string or pre-encoded bytes format) to
+            send.
+        :param priority: see :mod:`~aaopto_aotf.io_worker`. Only used with
+            the I/O worker thread.
+        """
+        msgs = [msg if isinstance(msg, bytes) else msg.encode('ascii')
+                for msg in msgs]
+        if not all(msg[:1] == CHANNEL_PREFIX_BYTES for msg in msgs):
+            raise ValueError("Only channel-prefixed messages can be batched.")
+        _, replies = self._run_io(priority, self._transact_batch,
+                                  b"".join(msgs), len(msgs))
+        return replies
+
+    def _transact_batch(self, data: bytes, num_replies: int):
+        """Write pre-encoded messages and read their one-line replies.
+
+        Each reply must arrive within the sum of the deadlines of its own
+        and all preceding messages, measured from the end of the write on
+        the wire.
+
+        :return: the :func:`time.perf_counter` time of the write and the
+            replies.
+        """
+        with self._io_lock:
+            self._check_input_idle()
+            self.log.debug("Sending: %r", data)
+            start_time = time.perf_counter()
+            self.ser.write(data)
+            replies = []
+            # The device only sees the last messages once the whole batch
+            # has been transmitted.
+            deadline = start_time + len(data) * BITS_PER_BYTE / BAUDRATE
+            for msg in data.split(EOL_BYTES)[:num_replies]:
+                msg += EOL_BYTES
+                self._last_data = msg
+                deadline += self._deadlines.get(command_root(msg))
+                line = self._read_reply(msg, EOL_BYTES, start_time, deadline,
+                                        learn=not replies)
+                line = line.decode("utf8")
+                self.log.debug("Received: %r", line)
+                replies.append(line.rsplit(EOL, 1)[0])
+        return start_time, replies
+
+    def _run_io(self, priority: int, func, *args):
+        """Run an I/O transaction on the worker thread if there is one or on
+        the calling thread otherwise."""
+        if self._io_worker is None:
+            return func(*args)
+        return self._io_worker.call(priority, func, *args)
+
+    def _priority(self, data: bytes):
+        """Return the I/O worker priority of a pre-encoded message."""
+        if data in self._high_priority_cmds:
+            return PRIORITY_HIGH
+        if data in LOW_PRIORITY_QUERIES or (
+                data[:1] == CHANNEL_PREFIX_BYTES and data[1:-2].isdigit()):
+            return PRIORITY_LOW
+        return PRIORITY_NORMAL
+
+    def _read_until(self, terminator: bytes,
+                    deadline: Optional[float] = None):
+        """Read from the device until `terminator` or a deadline.
+
+        Reads whatever is waiting in one call rather than byte-by-byte; any
+        bytes past the terminator stay in the receive buffer for the next
+        reply.
+
+        :param deadline: :func:`time.perf_counter` time after which to stop
+            waiting. Defaults to :obj:`TIMEOUT` from now.
+        :return: the bytes read, including the terminator if it arrived.
+        """
+        if deadline is None:
+            deadline = time.perf_counter() + TIMEOUT
+        buf = self._rx_buffer
+        start = 0
+        while True:
+            end = buf.find(terminator, start)
+            if end >= 0:
+                end += len(terminator)
+                data = bytes(buf[:end])
+                del buf[:end]
+                return data
+            # The terminator may straddle the next chunk.
+            start = max(len(buf) - len(terminator) + 1, 0)
+            remaining_s = deadline - time.perf_counter()
+            num_waiting = self.ser.in_waiting
+            if not num_waiting and remaining_s > 0:
+                # Rounded so that the port is rarely reconfigured.
+                timeout_s = bucket_ceil(remaining_s)
+                if self.ser.timeout != timeout_s:
+                    self.ser.timeout = timeout_s
+            chunk = b""
+            if num_waiting or remaining_s > 0:
+                chunk = self.ser.read(num_waiting or 1)
+            if not chunk:  # Timed out.
+                data = bytes(buf)
+                buf.clear()
+                return data
+            buf += chunk
 
-    def _send(self, msg: str, reply: bool = True,
+    def _read_reply(self, data: bytes, terminator: bytes, start_time: float,
+                    deadline: float, learn: bool = True,
+                    reply_startswith_eol: bool = False):
+        """Read the reply to `data`, record it, and resync on a timeout.
+
+        :param start_time: :func:`time.perf_counter` time of the write.
+        :param deadline: see :meth:`_read_until`.
+        :param learn: if True, adapt the deadline of this command to the
+            observed latency.
+        :param reply_startswith_eol: if True, discard a leading '\n\r'
+            first. Most commands without a channel prefix reply with one.
+        :raises ReplyTimeoutError: if the reply is incomplete at the deadline.
+        """
+        prefix = b""
+        if reply_startswith_eol:
+            prefix = self._read_until(EOL_BYTES, deadline)
+        line = b""
+        if prefix.endswith(EOL_BYTES) or not reply_startswith_eol:
+            line = self._read_until(terminator, deadline)
+        latency_s = time.perf_counter() - start_time
+        timed_out = not line.endswith(terminator)
+        self.command_stats.record(data, len(prefix) + len(line), latency_s,
+                                  timed_out)
+        root = command_root(data)
+        if timed_out:
+            self._deadlines.back_off(root)
+            # Drop the rest of a late reply so that it is not mistaken for
+            # the reply to the next message.
+            self._resync(terminator)
+            raise ReplyTimeoutError(f"No complete reply to {data!r} within "
+                                    f"{latency_s * 1e3:.1f} [ms]. Received "
+                                    f"{prefix + line!r}.")
+        if learn:
+            self._deadlines.observe(root, latency_s)
+        return line
+
+    def _resync(self, terminator: bytes):
+        """Discard input up to the end of the next reply and anything after
+        it, waiting at most the shortest reply deadline for the reply to end.
+        """
+        self._read_until(terminator,
+                         time.perf_counter() + self._deadlines.min_s)
+        return self._discard_input()
+
+    def _discard_input(self):
+        """Discard and return all buffered and waiting input."""
+        data = bytes(self._rx_buffer)
+        self._rx_buffer.clear()
+        num_waiting = self.ser.in_waiting
+        if num_waiting:
+            data += self.ser.read(num_waiting)
+        return data
+
+    def _check_input_idle(self):
+        """Discard input that arrived outside of a reply (e.g: a late or
+        duplicated reply) before writing, so that it is not mistaken for the
+        reply to the next message."""
+        if not self._rx_buffer and not self.ser.in_waiting:
+            return
+        stray = self._discard_input()
+        if not stray.endswith(REPLY_TERMINATORS):
+            stray += self._resync(EOL_BYTES)
+        self.command_stats.record_desync(command_root(self._last_data))
+        self.log.warning("Discarded unexpected input after the reply to "
+                         "%r: %r", self._last_data, stray)
+
+    def _send(self, msg: Union[str, bytes], reply: bool = True,
               multiline_reply: bool = False,
               read_until: str = EOL,
               reply_startswith_eol: bool = True):
         """Send message to the AOTF. Return the reply if it exists.,
 
-        :param msg: the message (in string format) to send.
+        :param msg: the message (in string or pre-encoded bytes format) to
+            send.
         :param reply: True if the msg expects a reply.
         :param read_until: the string match until we stop reading a reply.
         :param reply_startswith_eol: True if the first string is an EOL.
+        :raises ReplyTimeoutError: if the reply does not arrive within a
+            deadline learned from the latencies of earlier replies to the
+            same command (:obj:`TIMEOUT` until enough have been observed).
 
         """
-        self.log.debug(fr"Sending: {repr(msg)}")
-        self.ser.write(f"{msg}".encode('ascii'))
-        if not reply:
-            return
-        # Msgs that are prefixed with channel number return a one-line reply.
-        if msg.startswith(CmdRoots.CHANNEL_PREFIX):
-            line = self.ser.read_until(EOL.encode("ascii")).decode("utf8")
-            self.log.debug(fr"Received: {repr(line)}")
-            return line.rsplit(EOL, 1)[0]
-        # Most other cmds that issue a reply start with '\n\r'.
-        if reply_startswith_eol:  # Discard the first '\n\r'.
-            self.ser.read_until(EOL.encode("ascii"))
-        line = self.ser.read_until(read_until.encode("ascii")).decode("utf8")
-        self.log.debug(fr"Received: {repr(line)}")
-        # Return everything minus the last '\n\r?'.
+        data = msg if isinstance(msg, bytes) else msg.encode('ascii')
+        return self._run_io(self._priority(data), self._transact, data, reply,
+                            read_until, reply_startswith_eol)
+
+    def _transact(self, data: bytes, reply: bool, read_until: str,
+                  reply_startswith_eol: bool):
+        """Write a pre-encoded message and read its reply. See :meth:`_send`.
+        """
+        with self._io_lock:
+            self._check_input_idle()
+            # Lazy formatting; costs nothing extra when DEBUG is disabled.
+            self.log.debug("Sending: %r", data)
+            start_time = time.perf_counter()
+            self.ser.write(data)
+            self._last_data = data
+            if not reply:
+                self.command_stats.record(data, 0,
+                                          time.perf_counter() - start_time)
+                return
+            deadline = start_time + self._deadlines.get(command_root(data))
+            # Msgs that are prefixed with channel number return a one-line
+            # reply.
+            if data[:1] == CHANNEL_PREFIX_BYTES:
+                terminator = EOL_BYTES
+                reply_startswith_eol = False
+            else:
+                terminator = read_until.encode("ascii")
+            line = self._read_reply(data, terminator, start_time, deadline,
+                                    reply_startswith_eol=reply_startswith_eol)
+            line = line.decode("utf8")
+            self.log.debug("Received: %r", line)
+        # Return everything minus the last '\n\r' or '\n\r?'.
         return line.rsplit(EOL, 1)[0]
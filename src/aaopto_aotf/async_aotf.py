@@ -0,0 +1,472 @@
+"""asyncio driver for an AA OptoElectronics AOTF device."""
+
+import asyncio
+import time
+from typing import Optional, Union
+
+from aaopto_aotf.aotf import (BAUDRATE, CHANNEL_PREFIX_BYTES, EOL_BYTES,
+                              MAX_POWER_DBM, RESET_BOOT_TIME_S,
+                              RESET_READY_TIMEOUT_S, TIMEOUT, BaseMPDS,
+                              DesyncError, ReplyTimeoutError,
+                              channel_range_check, encode_cmd)
+from aaopto_aotf.device_codes import *
+from aaopto_aotf.stats import command_root
+
+# Longest wait for the rest of a late reply before discarding it.
+RESYNC_TIMEOUT_S = 0.02
+# Input that does not arrive within this long is not buffered yet.
+DRAIN_TIMEOUT_S = 0.001
+
+
+class AsyncMPDS(BaseMPDS):
+    """asyncio counterpart of :class:`~aaopto_aotf.aotf.MPDS`.
+
+    Every method that talks to the device is a coroutine, so waiting on a
+    reply yields to the event loop. The transport is any pair of
+    :class:`asyncio.StreamReader` and :class:`asyncio.StreamWriter`-like
+    objects, e.g: a serial port or pty opened with `pyserial-asyncio`, or
+    in-memory streams.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter, name: str = "stream",
+                 max_age: Optional[float] = None):
+        """Wrap an open stream pair. :meth:`connect` must be awaited before
+        any channel-specific call; prefer :meth:`open` or
+        :meth:`from_streams`, which do this.
+
+        :param reader: the stream to read replies from.
+        :param writer: the stream to write commands to. Must provide
+            ``write()`` and a ``drain()`` coroutine.
+        :param name: device name used for logging.
+        :param max_age: see :class:`~aaopto_aotf.aotf.BaseMPDS`.
+        """
+        super().__init__(name, max_age)
+        self.reader = reader
+        self.writer = writer
+        # Keep concurrent coroutines from interleaving commands and replies.
+        self._io_lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, com_port: str, max_age: Optional[float] = None):
+        """Open a serial port (or pty) and connect to the device.
+
+        Note: requires the `pyserial-asyncio` package.
+        """
+        try:
+            import serial_asyncio
+        except ImportError:
+            raise ImportError("Opening a serial port with AsyncMPDS requires "
+                              "pyserial-asyncio. Install it or pass your own "
+                              "streams to AsyncMPDS.from_streams().")
+        reader, writer = await serial_asyncio.open_serial_connection(
+            url=com_port, baudrate=BAUDRATE)
+        return await cls.from_streams(reader, writer, com_port, max_age)
+
+    @classmethod
+    async def from_streams(cls, reader: asyncio.StreamReader,
+                           writer: asyncio.StreamWriter, name: str = "stream",
+                           max_age: Optional[float] = None):
+        """Connect to a device over an already-open stream pair."""
+        aotf = cls(reader, writer, name, max_age)
+        await aotf.connect()
+        return aotf
+
+    async def connect(self):
+        """Determine if the device has 1, 4, or 8 channels."""
+        self.num_channels = len(await self.get_lines_status()) - 1
+        self._encode_pll_switch_cmds()
+
+    async def close(self):
+        """Close the underlying writer."""
+        self.writer.close()
+        if hasattr(self.writer, "wait_closed"):
+            await self.writer.wait_closed()
+
+    async def reset(self):
+        """Reset the device to external mode with stored parameter settings."""
+        await self._send(Cmds.RESET.value, reply=False)
+        # The device reloads the stored profile, so nothing cached holds.
+        self._cache.invalidate()
+        await self._wait_until_ready()
+
+    async def _wait_until_ready(self,
+                                timeout_s: float = RESET_READY_TIMEOUT_S):
+        """Wait for the device to boot, then probe it with back-off until it
+        replies with a well-formed status.
+        See :meth:`~aaopto_aotf.aotf.MPDS._wait_until_ready`."""
+        deadline = time.perf_counter() + timeout_s
+        await asyncio.sleep(RESET_BOOT_TIME_S)
+        backoff_s = RESET_BOOT_TIME_S / 5
+        while True:
+            try:
+                await self.get_channel_status(1)
+                return
+            except (ReplyTimeoutError, ValueError) as e:
+                if time.perf_counter() > deadline:
+                    raise ReplyTimeoutError(f"Device not ready {timeout_s} "
+                                            f"[s] after a reset.") from e
+            await asyncio.sleep(backoff_s)
+            backoff_s *= 2
+
+    async def save_profile(self):
+        """Save current frequency and power settings for all channels to the
+        current profile. See :meth:`~aaopto_aotf.aotf.MPDS.save_profile`."""
+        await self._send(Cmds.DATA_STORAGE.value, reply_startswith_eol=False,
+                         read_until="?")
+
+    @channel_range_check
+    async def set_frequency(self, channel: int, frequency: float,
+                            validate: bool = True):
+        """Set the active channel frequency in [MHz].
+        See :meth:`~aaopto_aotf.aotf.MPDS.set_frequency`."""
+        reply = await self._send(
+            encode_cmd(Cmds.FREQUENCY_ADJUST.value, channel, frequency))
+        self._cache_channel_reply(channel, reply, 'freq')
+        if validate:
+            actual_freq = (await self.get_channel_status(channel)).freq
+            self._check_frequency(frequency, actual_freq)
+
+    @channel_range_check
+    async def set_power_dbm(self, channel: int, dbm: float,
+                            validate: bool = True):
+        """Set the active channel power in [dBm].
+        See :meth:`~aaopto_aotf.aotf.MPDS.set_power_dbm`."""
+        if dbm > MAX_POWER_DBM or dbm < 0:
+            raise IndexError("Specified fine power [dBm] is out of range.")
+        reply = await self._send(
+            encode_cmd(Cmds.FINE_POWER_ADJUST.value, channel, dbm))
+        self._cache_channel_reply(channel, reply, 'power')
+        if validate:
+            actual_power = (await self.get_channel_status(channel)).power
+            self._check_power(dbm, actual_power)
+
+    @channel_range_check
+    async def set_output_power(self, channel: int, watts: float):
+        """Set the optical output power of a channel in [W].
+        See :meth:`~aaopto_aotf.aotf.MPDS.set_output_power`."""
+        await self.apply(
+            {channel: self._encode_output_power(channel, watts)},
+            validate=False)
+
+    async def set_wavelengths(self, wavelengths: dict,
+                              validate: bool = True):
+        """Tune many channels to optical wavelengths in [nm].
+        See :meth:`~aaopto_aotf.aotf.MPDS.set_wavelengths`."""
+        await self.apply(self._encode_wavelengths(wavelengths), validate)
+
+    async def apply(self, settings: dict, validate: bool = True):
+        """Apply settings to many channels with a single write.
+        See :meth:`~aaopto_aotf.aotf.MPDS.apply`."""
+        msgs, msg_channels, validated_channels = self._encode_apply(
+            settings, validate)
+        if not msgs:
+            return
+        try:
+            replies = await self._send_batch(msgs)
+        except ReplyTimeoutError:
+            # Any of the settings may have been applied.
+            for channel in settings:
+                self._cache.invalidate(channel)
+            raise
+        try:
+            self._apply_replies(settings, msg_channels, validated_channels,
+                                replies)
+        except DesyncError:
+            await self._recover_from_desync(replies[0])
+            raise
+
+    async def snapshot(self, max_age: Optional[float] = None):
+        """Return the full configuration of the device.
+        See :meth:`~aaopto_aotf.aotf.MPDS.snapshot`."""
+        snapshot = self._snapshot_from_cache(max_age)
+        if snapshot is None:
+            await self.refresh()
+            snapshot = self._snapshot_from_cache(float('inf'))
+            if snapshot is None:
+                raise ValueError("Could not read the full device "
+                                 "configuration.")
+        return snapshot
+
+    async def apply_profile(self, profile: dict, validate: bool = True,
+                            save: bool = False,
+                            max_age: Optional[float] = None):
+        """Send only the settings of `profile` that differ from the current
+        ones. See :meth:`~aaopto_aotf.aotf.MPDS.apply_profile`."""
+        settings, blanking_mode = self._diff_profile(
+            profile, await self.snapshot(max_age))
+        await self.apply(settings, validate)
+        if blanking_mode is not None:
+            await self.set_blanking_mode(blanking_mode)
+        if save:
+            await self.save_profile()
+        return settings
+
+    async def _set_channel_output_state(self, channel: int,
+                                        state: OutputState):
+        """Turn on or off the specified channel output."""
+        await self._send(self._pll_switch_cmds[(channel, state)])
+        self._cache.update(channel, state=state)
+
+    @channel_range_check
+    async def enable_channel(self, channel: int):
+        """Turn on the specified channel output."""
+        await self._set_channel_output_state(channel, OutputState.ON)
+
+    @channel_range_check
+    async def disable_channel(self, channel: int):
+        """Turn off the specified channel output."""
+        await self._set_channel_output_state(channel, OutputState.OFF)
+
+    @channel_range_check
+    async def set_channel_input_mode(self, channel: int, mode: InputMode):
+        """Set the channel input mode to internal or external."""
+        await self._send(
+            encode_cmd(Cmds.DRIVER_MODE.value, channel, mode.value))
+        self._cache.update(channel, mode=mode)
+
+    async def set_blanking_mode(self, mode: BlankingMode):
+        """Set the blanking mode to internal or external.
+        See :meth:`~aaopto_aotf.aotf.MPDS.set_blanking_mode`."""
+        await self._send(Cmds.DRIVER_MODE.value.format(0, mode.value))
+        self._cache.update('blanking', mode=mode)
+
+    async def set_external_input_voltage_range(self, vrange: VoltageRange):
+        """Set the voltage range of the external analog inputs."""
+        msg = Cmds.VOLTAGE_RANGE.value.format(vrange.value)
+        # Note: this command does not issue any characters in response.
+        await self._send(msg, reply=False)
+        self._cache.update('device', voltage_range=vrange)
+
+    async def set_global_input_mode(self,
+                                    mode: Union[InputMode, GlobalInputMode]):
+        """Set both driver mode for all channels and blanking mode to internal
+        or external."""
+        # InputMode values are reversed from GlobalInputMode values.
+        mode = GlobalInputMode[mode.name]
+        msg = Cmds.GLOBAL_DRIVER_MODE.value.format(mode.value)
+        # Note: this command does not issue any characters in response.
+        await self._send(msg, reply=False)
+        self._invalidate_modes()
+
+    async def refresh(self):
+        """Re-read all channel and blanking settings from the hardware."""
+        await self.get_lines_status()
+
+    async def get_lines_status(self):
+        """Return the line status as a dictionary keyed by channel index.
+        See :meth:`~aaopto_aotf.aotf.MPDS.get_lines_status`."""
+        reply = await self._send(Queries.LINES_STATUS.value,
+                                 read_until="?")
+        return self._parse_lines_status(reply)
+
+    @channel_range_check
+    async def get_channel_status(self, channel: int):
+        """Read the frequency, power, and output state of one channel from
+        the hardware with a single query.
+
+        :return: a :obj:`~ChannelStatus`.
+        """
+        reply = await self._send(
+            encode_cmd(Queries.CHANNEL_SPECIFIC_STATUS.value, channel))
+        status = self._parse_channel_status(reply)
+        if status.channel != channel:
+            await self._recover_from_desync(reply)
+            raise DesyncError(f"Received the status of channel "
+                              f"{status.channel} instead of {channel}.")
+        return status
+
+    async def get_all_channel_status(self):
+        """Read the status of every channel with pipelined queries.
+
+        :return: a dict of :obj:`~ChannelStatus` keyed by channel index.
+        """
+        channels = list(range(1, self.num_channels + 1))
+        msgs = [encode_cmd(Queries.CHANNEL_SPECIFIC_STATUS.value, channel)
+                for channel in channels]
+        replies = await self._send_batch(msgs)
+        statuses = [self._parse_channel_status(reply) for reply in replies]
+        try:
+            self._check_reply_channels(
+                [status.channel for status in statuses], channels)
+        except DesyncError:
+            await self._recover_from_desync(replies[0])
+            raise
+        return {status.channel: status for status in statuses}
+
+    async def _cached(self, key, field: str, max_age: Optional[float], read):
+        """Return a cached value; await `read()` to fill it on a miss."""
+        value = self._cache.get(key, field, max_age)
+        if value is None:
+            await read()
+            value = self._cache.get(key, field, max_age=float('inf'))
+        return value
+
+    @channel_range_check
+    async def get_frequency(self, channel: int,
+                            max_age: Optional[float] = None):
+        """Return the frequency in [MHz] of the current channel.
+        See :meth:`~aaopto_aotf.aotf.MPDS.get_frequency`."""
+        return await self._cached(channel, 'freq', max_age,
+                                  lambda: self.get_channel_status(channel))
+
+    @channel_range_check
+    async def get_power_dbm(self, channel: int,
+                            max_age: Optional[float] = None):
+        """return the fine power value of the current channel."""
+        return await self._cached(channel, 'power', max_age,
+                                  lambda: self.get_channel_status(channel))
+
+    @channel_range_check
+    async def get_channel_input_mode(self, channel: int,
+                                     max_age: Optional[float] = None):
+        """Return the input mode (internal or external) of the channel."""
+        return await self._cached(channel, 'mode', max_age,
+                                  self.get_lines_status)
+
+    @channel_range_check
+    async def get_channel_output_state(self, channel: int,
+                                       max_age: Optional[float] = None):
+        """Get state of the pll for the current channel."""
+        state = await self._cached(channel, 'state', max_age,
+                                   lambda: self.get_channel_status(channel))
+        return state == OutputState.ON
+
+    async def get_blanking_mode(self, max_age: Optional[float] = None):
+        """return the blanking mode (internal or external)."""
+        return await self._cached('blanking', 'mode', max_age,
+                                  self.get_lines_status)
+
+    async def get_product_id(self):
+        """Get the product id."""
+        reply = await self._send(Queries.PRODUCT_ID, read_until="?",
+                                 reply_startswith_eol=False)
+        return reply.rstrip()
+
+    async def _read_until(self, terminator: bytes):
+        """Read until `terminator` without blocking the event loop.
+
+        :raises asyncio.TimeoutError: if no terminator arrives within
+            :obj:`~aaopto_aotf.aotf.TIMEOUT` seconds.
+        :return: the bytes read, including the terminator if it arrived.
+        """
+        try:
+            return await asyncio.wait_for(
+                self.reader.readuntil(terminator), TIMEOUT)
+        except asyncio.IncompleteReadError as e:  # Stream closed.
+            return e.partial
+
+    async def _send_batch(self, msgs: list):
+        """Send several channel-prefixed messages with a single write and
+        return their one-line replies in order."""
+        msgs = [msg if isinstance(msg, bytes) else msg.encode('ascii')
+                for msg in msgs]
+        if not all(msg[:1] == CHANNEL_PREFIX_BYTES for msg in msgs):
+            raise ValueError("Only channel-prefixed messages can be batched.")
+        data = b"".join(msgs)
+        async with self._io_lock:
+            self.log.debug("Sending: %r", data)
+            start_time = time.perf_counter()
+            self.writer.write(data)
+            await self.writer.drain()
+            replies = []
+            for msg in msgs:
+                line = await self._read_reply(msg, EOL_BYTES, start_time)
+                line = line.decode("utf8")
+                self.log.debug("Received: %r", line)
+                replies.append(line.rsplit(EOL, 1)[0])
+        return replies
+
+    async def _send(self, msg: Union[str, bytes], reply: bool = True,
+                    read_until: str = EOL,
+                    reply_startswith_eol: bool = True):
+        """Send message to the AOTF. Return the reply if it exists.
+        See :meth:`~aaopto_aotf.aotf.MPDS._send`."""
+        data = msg if isinstance(msg, bytes) else msg.encode('ascii')
+        async with self._io_lock:
+            self.log.debug("Sending: %r", data)
+            start_time = time.perf_counter()
+            self.writer.write(data)
+            await self.writer.drain()
+            if not reply:
+                self.command_stats.record(data, 0,
+                                          time.perf_counter() - start_time)
+                return
+            # Msgs that are prefixed with channel number return a one-line
+            # reply.
+            if data[:1] == CHANNEL_PREFIX_BYTES:
+                terminator = EOL_BYTES
+                reply_startswith_eol = False
+            else:
+                terminator = read_until.encode("ascii")
+            line = await self._read_reply(data, terminator, start_time,
+                                          reply_startswith_eol)
+            line = line.decode("utf8")
+            self.log.debug("Received: %r", line)
+        # Return everything minus the last '\n\r' or '\n\r?'.
+        return line.rsplit(EOL, 1)[0]
+
+    async def _read_reply(self, data: bytes, terminator: bytes,
+                          start_time: float,
+                          reply_startswith_eol: bool = False):
+        """Read the reply to `data`, record it in :attr:`command_stats`, and
+        resync on a timeout.
+
+        :param reply_startswith_eol: if True, discard a leading '\n\r'
+            first. Most commands without a channel prefix reply with one.
+        :raises ReplyTimeoutError: if the reply is incomplete in time.
+        """
+        num_eol_bytes = len(EOL_BYTES) if reply_startswith_eol else 0
+        try:
+            if reply_startswith_eol:
+                await self._read_until(EOL_BYTES)
+            line = await self._read_until(terminator)
+        except asyncio.TimeoutError:
+            latency_s = time.perf_counter() - start_time
+            self.command_stats.record(data, 0, latency_s, True)
+            # Drop the rest of a late reply so that it is not mistaken for
+            # the reply to the next message.
+            await self._resync(terminator)
+            raise ReplyTimeoutError(f"No complete reply to {data!r} within "
+                                    f"{latency_s * 1e3:.1f} [ms].") from None
+        self.command_stats.record(data, num_eol_bytes + len(line),
+                                  time.perf_counter() - start_time,
+                                  not line.endswith(terminator))
+        return line
+
+    async def _resync(self, terminator: bytes):
+        """Discard input up to the end of the next reply and anything after
+        it, waiting at most :obj:`RESYNC_TIMEOUT_S` for the reply to end.
+
+        :return: the discarded bytes.
+        """
+        try:
+            data = await asyncio.wait_for(self.reader.readuntil(terminator),
+                                          RESYNC_TIMEOUT_S)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            data = b""
+        return data + await self._discard_input()
+
+    async def _discard_input(self):
+        """Discard and return all input that has already arrived."""
+        data = b""
+        while True:
+            try:
+                chunk = await asyncio.wait_for(self.reader.read(4096),
+                                               DRAIN_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                return data
+            if not chunk:  # Stream closed.
+                return data
+            data += chunk
+
+    async def _recover_from_desync(self, reply: str):
+        """Count a reply that belongs to an earlier message and discard the
+        input that the stream is behind by."""
+        async with self._io_lock:
+            stray = await self._resync(EOL_BYTES)
+        self.command_stats.record_desync(
+            command_root(reply.encode('ascii', 'replace')))
+        self.log.warning("Discarded input after the out-of-order reply %r: "
+                         "%r", reply, stray)
@@ -0,0 +1,136 @@
+"""Lookup tables from desired optical output power to AOTF settings.
+
+Note: requires numpy.
+"""
+
+import json
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Measurements within this [MHz] of the optimal frequency belong to it.
+FREQ_TOLERANCE_MHZ = 0.0005
+
+
+class ChannelCalibration:
+    """Monotone table of the optical output power [W] produced by each RF
+    power [dBm] at the optimal frequency of one channel.
+
+    Only the rising part of the measured curve (up to its maximum) is kept,
+    and noise dips are flattened, so that every reachable output power maps
+    to exactly one RF power.
+    """
+
+    def __init__(self, freq: float, dbm, watts):
+        """Build the table.
+
+        :param freq: the optimal frequency in [MHz].
+        :param dbm: RF powers in [dBm], in any order.
+        :param watts: the optical output power in [W] measured at each RF
+            power.
+        """
+        if np is None:
+            raise ImportError("Calibration tables require numpy. Install it "
+                              "with `pip install aaopto-aotf[calibration]`.")
+        dbm = np.asarray(dbm, dtype=float)
+        watts = np.asarray(watts, dtype=float)
+        order = np.argsort(dbm)
+        dbm, watts = dbm[order], watts[order]
+        peak = int(np.argmax(watts))
+        dbm, watts = dbm[:peak + 1], np.maximum.accumulate(watts[:peak + 1])
+        # Keep the lowest RF power that reaches each output power.
+        rising = np.concatenate(([True], np.diff(watts) > 0))
+        if np.count_nonzero(rising) < 2:
+            raise ValueError("A calibration needs at least two measurements "
+                             "of increasing output power.")
+        self.freq = float(freq)
+        self.dbm_table = dbm[rising]
+        self.watts_table = watts[rising]
+        self.min_watts = float(self.watts_table[0])
+        self.max_watts = float(self.watts_table[-1])
+        # Ramps tend to revisit the same powers.
+        self._scalar_dbm = lru_cache(maxsize=4096)(self._interpolate_dbm)
+
+    @classmethod
+    def from_points(cls, points):
+        """Build the table from calibration sweep measurements.
+
+        :param points: rows of (power [dBm], frequency [MHz], watts [W]), as
+            written by `examples/calibration_sweep.py`. The rows at the
+            frequency of the highest output power are used.
+        """
+        if np is None:
+            raise ImportError("Calibration tables require numpy. Install it "
+                              "with `pip install aaopto-aotf[calibration]`.")
+        points = np.asarray(points, dtype=float)
+        best_freq = points[np.argmax(points[:, 2]), 1]
+        at_best_freq = np.abs(points[:, 1] - best_freq) <= FREQ_TOLERANCE_MHZ
+        return cls(best_freq, points[at_best_freq, 0],
+                   points[at_best_freq, 2])
+
+    def _interpolate_dbm(self, watts: float) -> float:
+        """Interpolate the RF power of one output power."""
+        if watts < self.min_watts or watts > self.max_watts:
+            raise ValueError(f"Output power {watts} [W] is outside the "
+                             f"calibrated range of {self.min_watts} to "
+                             f"{self.max_watts} [W].")
+        return float(np.interp(watts, self.watts_table, self.dbm_table))
+
+    def dbm(self, watts):
+        """Return the RF power [dBm] that produces an output power.
+
+        :param watts: output power in [W]; a number or an array.
+        :raises ValueError: if any output power is outside of the measured
+            range, :attr:`min_watts` to :attr:`max_watts`.
+        """
+        if np.ndim(watts) == 0:
+            return self._scalar_dbm(float(watts))
+        watts = np.asarray(watts, dtype=float)
+        if watts.size and (watts.min() < self.min_watts
+                           or watts.max() > self.max_watts):
+            raise ValueError(f"Output powers must be within the calibrated "
+                             f"range of {self.min_watts} to {self.max_watts} "
+                             f"[W].")
+        return np.interp(watts, self.watts_table, self.dbm_table)
+
+    def dbm_for_fraction(self, fraction):
+        """Return the RF power [dBm] that produces a fraction (0 to 1) of the
+        maximum output power. Accepts a number or an array.
+
+        :raises ValueError: if any fraction is below the lowest measured
+            output power.
+        """
+        return self.dbm(np.multiply(fraction, self.max_watts))
+
+    def watts(self, dbm):
+        """Return the output power [W] produced by an RF power [dBm].
+        Accepts a number or an array."""
+        return np.interp(dbm, self.dbm_table, self.watts_table)
+
+    def to_dict(self):
+        """Return the table as a JSON-serializable dict."""
+        return {'freq': self.freq, 'dbm': self.dbm_table.tolist(),
+                'watts': self.watts_table.tolist()}
+
+
+class Calibration(dict):
+    """:class:`ChannelCalibration` tables keyed by channel index, stored as
+    JSON."""
+
+    @classmethod
+    def load(cls, path: str):
+        """Load tables saved with :meth:`save`."""
+        with open(path, 'r') as calibration_file:
+            tables = json.load(calibration_file)
+        return cls({int(channel): ChannelCalibration(**table)
+                    for channel, table in tables.items()})
+
+    def save(self, path: str):
+        """Save every table to a JSON file."""
+        with open(path, 'w') as calibration_file:
+            json.dump({channel: table.to_dict()
+                       for channel, table in self.items()},
+                      calibration_file, indent=2)
@@ -0,0 +1,338 @@
+"""Local daemon that holds an MPDS connection open for many processes.
+
+The daemon serves :class:`~aaopto_aotf.aotf.MPDS` calls over a Unix domain
+socket (Unix-only), so short-lived scripts skip connection setup and several
+processes can share one device. Each request is one line of compact JSON:
+``["set_frequency", [1, 110.5], {"validate": false}]``, where the arguments
+and keyword arguments may be omitted. A line holding a list of requests is a
+batch, run in order without interleaving other clients and stopped at the
+first error. Each reply is one line: ``{"r": result}`` or
+``{"e": [exception name, message]}``, or a list of them for a batch.
+
+Start it with ``aaopto-aotf /dev/ttyUSB0`` and connect with
+:class:`MPDSClient`.
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import stat
+import tempfile
+import threading
+from enum import Enum
+from functools import partial
+from typing import Optional
+
+from aaopto_aotf.aotf import MPDS, DesyncError, ReplyTimeoutError
+from aaopto_aotf.descriptors import DescriptorCache
+from aaopto_aotf.device_codes import *
+
+# Public MPDS methods that clients may call. The connection and the status
+# poller belong to the daemon, and pre-encoded settings do not serialize.
+METHODS = frozenset(
+    name for name in dir(MPDS)
+    if not name.startswith('_') and callable(getattr(MPDS, name))) \
+    - {'close', 'start_polling', 'stop_polling', 'encode_apply',
+       'apply_encoded'}
+# MPDS attributes that clients may read.
+ATTRIBUTES = frozenset({'num_channels'})
+
+# Types that are tagged on the wire so that they are decoded as themselves.
+CODEC_TYPES = {cls.__name__: cls for cls in
+               (BlankingMode, ChannelStatus, CmdRoots, GlobalInputMode,
+                InputMode, OutputState, VoltageRange)}
+# Exceptions that clients re-raise as themselves. Others are re-raised as
+# RuntimeError.
+EXCEPTIONS = {cls.__name__: cls for cls in
+              (AttributeError, DesyncError, IndexError, KeyError, OSError,
+               ReplyTimeoutError, RuntimeError, TimeoutError, TypeError,
+               ValueError)}
+SEPARATORS = (',', ':')
+
+
+def default_socket_path(com_port: str) -> str:
+    """Return the socket path of the daemon of a serial port."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir())
+    return os.path.join(runtime_dir,
+                        f"aaopto-aotf-{os.path.basename(com_port)}.sock")
+
+
+def encode(obj):
+    """Return `obj` in JSON-serializable form, tagging enums, named tuples,
+    and dicts with non-string keys (e.g: channel indices)."""
+    if isinstance(obj, Enum):
+        return {"$e": [type(obj).__name__, obj.value]}
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        return {"$t": [type(obj).__name__, [encode(v) for v in obj]]}
+    if isinstance(obj, dict):
+        if all(type(key) is str for key in obj):
+            return {key: encode(value) for key, value in obj.items()}
+        return {"$d": [[encode(key), encode(value)]
+                       for key, value in obj.items()]}
+    if isinstance(obj, (list, tuple)):
+        return [encode(value) for value in obj]
+    return obj
+
+
+def decode_object(obj: dict):
+    """JSON object hook that reverses the tags of :func:`encode`."""
+    if len(obj) == 1:
+        (tag, value), = obj.items()
+        if tag == "$e":
+            return CODEC_TYPES[value[0]](value[1])
+        if tag == "$t":
+            return CODEC_TYPES[value[0]](*value[1])
+        if tag == "$d":
+            return {key: item for key, item in value}
+    return obj
+
+
+def dumps(obj) -> bytes:
+    """Encode one request or reply line."""
+    return json.dumps(encode(obj), separators=SEPARATORS).encode() + b"\n"
+
+
+def loads(line: bytes):
+    """Decode one request or reply line."""
+    return json.loads(line, object_hook=decode_object)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Serve the request lines of one client connection."""
+
+    def handle(self):
+        """Reply to every request line until the client disconnects."""
+        for line in self.rfile:
+            self.wfile.write(dumps(self.server.respond(line)))
+
+
+class MPDSDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve the calls of many local clients to one open
+    :class:`~aaopto_aotf.aotf.MPDS` over a Unix domain socket."""
+
+    daemon_threads = True
+
+    def __init__(self, aotf: MPDS, path: str):
+        """Bind the socket. Call :meth:`serve_forever` to start serving.
+
+        :param aotf: the connected device.
+        :param path: location of the socket, readable and writable by the
+            current user only.
+        :raises RuntimeError: if another daemon is serving at `path`.
+        :raises FileExistsError: if `path` exists and is not a socket.
+        """
+        self.aotf = aotf
+        self.path = path
+        # Keeps requests and batches of different clients apart.
+        self._lock = threading.Lock()
+        self._remove_stale_socket()
+        # Create the socket without access for others, rather than
+        # restricting it after it is already reachable.
+        umask = os.umask(0o077)
+        try:
+            super().__init__(path, RequestHandler)
+        finally:
+            os.umask(umask)
+
+    def _remove_stale_socket(self):
+        """Remove a socket file left behind by a daemon that died."""
+        try:
+            mode = os.lstat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f"{self.path} exists and is not a socket.")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except ConnectionRefusedError:  # Nothing is listening.
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"A daemon is already serving {self.path}.")
+
+    def server_close(self):
+        """Close and remove the socket."""
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def call(self, request: list):
+        """Run one ``[name, args, kwds]`` request and return its result."""
+        name = request[0]
+        args = request[1] if len(request) > 1 else []
+        kwds = request[2] if len(request) > 2 else {}
+        if name in ATTRIBUTES:
+            return getattr(self.aotf, name)
+        if name not in METHODS:
+            raise AttributeError(f"MPDS has no method {name!r}.")
+        return getattr(self.aotf, name)(*args, **kwds)
+
+    def _reply(self, request: list):
+        """Run one request and return its reply."""
+        try:
+            return {"r": self.call(request)}
+        except Exception as e:
+            return {"e": [type(e).__name__, str(e)]}
+
+    def respond(self, line: bytes):
+        """Run the request or batch of one line and return its reply."""
+        try:
+            request = loads(line)
+        except (ValueError, KeyError, TypeError) as e:
+            return {"e": ["ValueError", f"Malformed request: {e!r}"]}
+        if not isinstance(request, list) or not request:
+            return {"e": ["ValueError", "A request must be a non-empty "
+                                        "list."]}
+        with self._lock:
+            if not isinstance(request[0], list):
+                return self._reply(request)
+            replies = []
+            for batched_request in request:
+                replies.append(self._reply(batched_request))
+                if "e" in replies[-1]:
+                    break
+            return replies
+
+
+def result_of(reply: dict):
+    """Return the result of a reply or raise its exception."""
+    if "e" in reply:
+        name, message = reply["e"]
+        exception_type = EXCEPTIONS.get(name)
+        if exception_type is None:
+            raise RuntimeError(f"{name}: {message}")
+        raise exception_type(message)
+    return reply["r"]
+
+
+class MPDSClient:
+    """Call the methods of the :class:`~aaopto_aotf.aotf.MPDS` held by an
+    :class:`MPDSDaemon`, e.g: ``client.set_frequency(1, 110.5)``.
+
+    Connecting only opens the socket, so it costs no device traffic.
+    """
+
+    def __init__(self, com_port: str, path: Optional[str] = None,
+                 timeout: Optional[float] = None):
+        """Connect to the daemon of a serial port.
+
+        :param com_port: the serial port the daemon was started with.
+        :param path: the daemon socket. Defaults to the socket of
+            `com_port`.
+        :param timeout: socket timeout in [s], or None to wait for replies
+            indefinitely.
+        """
+        self.path = path or default_socket_path(com_port)
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(self.path)
+        self._file = self._sock.makefile('rwb')
+
+    def _exchange(self, request: list):
+        """Send one request line and return its decoded reply."""
+        with self._lock:
+            self._file.write(dumps(request))
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError("The daemon closed the connection.")
+        return loads(line)
+
+    def call(self, name: str, *args, **kwds):
+        """Call an MPDS method by name and return its result."""
+        return result_of(self._exchange([name, args, kwds]))
+
+    def batch(self, calls: list):
+        """Run several calls in order with one round trip, without other
+        clients' calls in between.
+
+        :param calls: ``(name, args)`` or ``(name, args, kwds)`` tuples.
+        :return: the result of every call.
+        :raises Exception: the exception of the first call that failed. The
+            calls after it are not run.
+        """
+        if not calls:
+            return []
+        return [result_of(reply)
+                for reply in self._exchange([list(call) for call in calls])]
+
+    @property
+    def num_channels(self):
+        """Return the channel count of the device."""
+        return self.call('num_channels')
+
+    def close(self):
+        """Disconnect from the daemon. The device stays connected."""
+        self._file.close()
+        self._sock.close()
+
+    def __getattr__(self, name: str):
+        """Return a function that calls an MPDS method through the daemon."""
+        if name in METHODS:
+            return partial(self.call, name)
+        raise AttributeError(f"{type(self).__name__} has no attribute "
+                             f"{name!r}.")
+
+
+def main():
+    """Serve one device until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("com_port",
+                        help="name of the serial port as it appears on the "
+                             "pc.")
+    parser.add_argument("--socket", default=None,
+                        help="path of the Unix socket to serve on. Defaults "
+                             "to aaopto-aotf-<port name>.sock in "
+                             "$XDG_RUNTIME_DIR or the temporary directory.")
+    parser.add_argument("--max_age", type=float, default=None,
+                        help="age [s] beyond which cached settings are "
+                             "re-read from the device.")
+    parser.add_argument("--num_channels", type=int, default=None,
+                        choices=(1, 4, 8),
+                        help="channel count of the device. Skips querying "
+                             "it.")
+    parser.add_argument("--descriptor_cache", default=None,
+                        help="JSON file of known devices for faster "
+                             "connection.")
+    parser.add_argument("--io_thread", default=False, action="store_true",
+                        help="run serial I/O on a dedicated thread.")
+    parser.add_argument("--calibration", default=None,
+                        help="JSON output power calibration file for "
+                             "set_output_power().")
+    parser.add_argument("--tuning", nargs=2, default=None,
+                        metavar=("PATH", "CRYSTAL"),
+                        help="JSON tuning curves file and the name of this "
+                             "device's crystal in it, for "
+                             "set_wavelengths().")
+    args = parser.parse_args()
+    descriptor_cache = None
+    if args.descriptor_cache is not None:
+        descriptor_cache = DescriptorCache(args.descriptor_cache)
+    aotf = MPDS(args.com_port, args.max_age, args.io_thread,
+                num_channels=args.num_channels,
+                descriptor_cache=descriptor_cache)
+    if args.calibration is not None:
+        from aaopto_aotf.calibration import Calibration
+        aotf.calibration = Calibration.load(args.calibration)
+    if args.tuning is not None:
+        from aaopto_aotf.tuning import TuningCurves
+        aotf.tuning = TuningCurves.load(args.tuning[0])[args.tuning[1]]
+    path = args.socket or default_socket_path(args.com_port)
+    daemon = MPDSDaemon(aotf, path)
+    print(f"Serving {args.com_port} on {path}. Ctrl-C to stop.", flush=True)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
+        aotf.close()
+
+
+if __name__ == "__main__":
+    main()
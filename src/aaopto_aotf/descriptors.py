@@ -0,0 +1,48 @@
+"""Persistent cache of device descriptors that speeds up connecting."""
+
+import json
+import os
+import threading
+from typing import Optional
+
+
+class DescriptorCache:
+    """JSON file of device descriptors (e.g: the channel count) keyed by
+    product ID.
+
+    Pass one to :class:`~aaopto_aotf.aotf.MPDS` so that a device that was
+    seen before is identified with the short product ID query instead of
+    the full lines status query.
+    """
+
+    def __init__(self, path: str):
+        """Load the cache file if it exists.
+
+        :param path: location of the cache file. Created on the first
+            :meth:`put`.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r') as cache_file:
+                self._descriptors = json.load(cache_file)
+        except FileNotFoundError:
+            self._descriptors = {}
+
+    def get(self, product_id: str) -> Optional[dict]:
+        """Return the descriptor of a device, or None if unknown."""
+        with self._lock:
+            return self._descriptors.get(product_id)
+
+    def put(self, product_id: str, **descriptor):
+        """Store the descriptor of a device and save the cache file."""
+        with self._lock:
+            if self._descriptors.get(product_id) == descriptor:
+                return
+            self._descriptors[product_id] = descriptor
+            # Write to a temporary file first so that a crash never leaves
+            # a truncated cache behind.
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(self._descriptors, cache_file, indent=2)
+            os.replace(tmp_path, self.path)
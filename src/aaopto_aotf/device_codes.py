@@ -1,5 +1,7 @@
 """Device Codes for communicating with the AOTF."""
 
+from typing import NamedTuple
+
 try:  # a 3.11 feature
     from enum import StrEnum
 except ImportError:
@@ -83,3 +85,11 @@ class BlankingMode(StrEnum):
 class GlobalInputMode(StrEnum):
     INTERNAL = "0"
     EXTERNAL = "1"
+
+
+class ChannelStatus(NamedTuple):
+    """Contents of a :obj:`~Replies.CHANNEL_SPECIFIC_STATUS` reply."""
+    channel: int
+    freq: float  # [MHz]
+    power: float  # [dBm]
+    state: OutputState
@@ -0,0 +1,378 @@
+"""Software stand-in for an MPDS device, for benchmarking without hardware.
+
+:class:`MPDSEmulator` models the protocol in :mod:`~aaopto_aotf.device_codes`
+(framing, replies, no-reply commands, and factory limits).
+:class:`PtyEmulator` serves it on a Linux pseudo-terminal so that an
+unmodified :class:`~aaopto_aotf.aotf.MPDS` can connect to it by port name.
+"""
+
+import argparse
+import copy
+import os
+import re
+import select
+import threading
+import time
+from typing import Tuple
+
+from aaopto_aotf.aotf import (BAUDRATE, BITS_PER_BYTE, EOL_BYTES,
+                              MAX_POWER_DBM, RESET_BOOT_TIME_S, TIMEOUT)
+from aaopto_aotf.device_codes import *
+
+DEFAULT_FREQ_RANGE_MHZ = (20.0, 150.0)
+
+CHANNEL_CMD_PATTERN = re.compile(r"L(\d+)([A-Z]?)(.*)")
+# Commands that take effect without EOL termination.
+UNTERMINATED_CMDS = (Cmds.DATA_STORAGE.value, Cmds.RESET.value)
+
+ON_OFF_NAMES = {OutputState.ON: "ON", OutputState.OFF: "OFF"}
+
+
+class MPDSEmulator:
+    """Protocol-accurate model of an MPDS device.
+
+    Bytes written to the device go in through :meth:`feed`, which returns the
+    bytes the device would reply with.
+    """
+
+    def __init__(self, num_channels: int = 8,
+                 freq_range_mhz: Tuple[float, float] = DEFAULT_FREQ_RANGE_MHZ,
+                 product_id: str = None, preamble: bool = False,
+                 boot_time_s: float = RESET_BOOT_TIME_S):
+        """Create a device in its power-on state.
+
+        :param num_channels: 1, 4, or 8.
+        :param freq_range_mhz: factory-set minimum and maximum frequencies.
+            Requested frequencies are clamped to this range.
+        :param product_id: reply to the product id query.
+        :param preamble: if True, start the lines status reply with the
+            'Temp = 0', 'Alim = 0', 'USB = 0' lines that some units print.
+        :param boot_time_s: time after a reset during which every command is
+            answered with a bare EOL.
+        """
+        if num_channels not in (1, 4, 8):
+            raise ValueError("MPDS models have 1, 4, or 8 channels.")
+        self.num_channels = num_channels
+        self.min_freq, self.max_freq = freq_range_mhz
+        self.product_id = product_id or f"MPDS{num_channels}C-EMULATOR"
+        self.preamble = preamble
+        self.boot_time_s = boot_time_s
+        self.channels = {
+            channel: {'freq': self.min_freq, 'power': 0.0,
+                      'state': OutputState.OFF, 'mode': InputMode.EXTERNAL}
+            for channel in range(1, num_channels + 1)}
+        self.blanking_mode = BlankingMode.EXTERNAL
+        self.voltage_range = VoltageRange.ZERO_TO_FIVE_VOLTS
+        self.profile = copy.deepcopy(self.channels)
+        self._booted_time = 0
+        self._rx_buffer = ""
+
+    def feed(self, data: bytes) -> bytes:
+        """Process bytes written to the device and return its reply bytes.
+
+        Incomplete commands are kept until the rest of them arrives.
+        """
+        self._rx_buffer += data.decode('ascii')
+        replies = []
+        while self._rx_buffer:
+            if self._rx_buffer.startswith(UNTERMINATED_CMDS):
+                cmd = self._rx_buffer[0]
+                self._rx_buffer = self._rx_buffer[1:]
+            else:
+                cmd, sep, rest = self._rx_buffer.partition(EOL)
+                if not sep:
+                    break
+                self._rx_buffer = rest
+            try:
+                replies.append(self._execute(cmd))
+            except ValueError:  # Malformed value.
+                replies.append(EOL)
+        return "".join(replies).encode('ascii')
+
+    def _execute(self, cmd: str) -> str:
+        """Execute one command (without its EOL) and return the reply."""
+        if time.monotonic() < self._booted_time:
+            return EOL
+        if cmd == Cmds.RESET.value:
+            self.channels = copy.deepcopy(self.profile)
+            self._booted_time = time.monotonic() + self.boot_time_s
+            return ""
+        if cmd == Cmds.DATA_STORAGE.value:
+            self.profile = copy.deepcopy(self.channels)
+            return EOL + "?"
+        if cmd == CmdRoots.LINES_STATUS.value:
+            return self._lines_status()
+        if cmd == CmdRoots.PRODUCT_ID.value:
+            return self.product_id + EOL + "?"
+        if cmd.startswith((CmdRoots.VOLTAGE_RANGE.value,
+                           CmdRoots.DRIVER_MODE.value)):
+            return self._execute_global_cmd(cmd[0], cmd[1:])
+        match = CHANNEL_CMD_PATTERN.fullmatch(cmd)
+        if match is None:
+            return ""
+        return self._execute_channel_cmd(int(match[1]), match[2], match[3])
+
+    def _execute_global_cmd(self, root: str, value: str):
+        """Execute a global setting command. Note: these issue no reply."""
+        if root == CmdRoots.VOLTAGE_RANGE.value:
+            self.voltage_range = VoltageRange(value)
+        elif value:
+            # The mode is optional since Cmds.GLOBAL_DRIVER_MODE does not
+            # carry it.
+            mode = GlobalInputMode(value)
+            for settings in self.channels.values():
+                settings['mode'] = InputMode[mode.name]
+            self.blanking_mode = BlankingMode[mode.name]
+        return ""
+
+    def _execute_channel_cmd(self, channel: int, root: str, value: str):
+        """Execute a channel-prefixed command and return its one-line reply."""
+        if channel == 0 and root == CmdRoots.DRIVER_MODE.value:
+            self.blanking_mode = BlankingMode(value)
+            return self._blanking_status() + EOL
+        if channel not in self.channels:
+            return EOL
+        settings = self.channels[channel]
+        if root == CmdRoots.FREQUENCY_ADJUST.value:
+            freq = min(max(float(value), self.min_freq), self.max_freq)
+            settings['freq'] = round(freq, 3)
+        elif root == CmdRoots.FINE_POWER_ADJUST.value:
+            power = min(max(float(value), 0.0), MAX_POWER_DBM)
+            settings['power'] = round(power, 1)
+        elif root == CmdRoots.PLL_SWITCH.value:
+            settings['state'] = OutputState(value)
+        elif root == CmdRoots.DRIVER_MODE.value:
+            settings['mode'] = InputMode(value)
+        elif root:
+            return EOL
+        return (f"l{channel}F{settings['freq']:.3f}P{settings['power']:.1f}"
+                f"S{settings['state'].value}" + EOL)
+
+    def _blanking_status(self):
+        """Return the blanking line of the lines status reply."""
+        return f"Blanking ON {self.blanking_mode.name}"
+
+    def _lines_status(self):
+        """Return the full lines status reply."""
+        lines = ["Temp = 0", "Alim = 0", "USB = 0"] if self.preamble else []
+        for channel, settings in self.channels.items():
+            lines.append(f"l{channel} F={settings['freq']:.3f} "
+                         f"P={settings['power']:.3f} "
+                         f"{ON_OFF_NAMES[settings['state']]} "
+                         f"{settings['mode'].name}")
+        lines.append(self._blanking_status())
+        return EOL + EOL.join(lines) + EOL + "?"
+
+
+class EmulatedSerial:
+    """In-memory, serial-like transport to an :class:`MPDSEmulator`.
+
+    Pass it to ``MPDS(name, ser=EmulatedSerial())``. Each reply becomes
+    readable after the time the command and reply would take on the wire at
+    the emulated baud rate plus a fixed processing latency. Traffic counters
+    make it suitable for measuring round trips and bytes per call.
+    """
+
+    def __init__(self, emulator: MPDSEmulator = None,
+                 baudrate: int = BAUDRATE, latency_s: float = 0.0,
+                 timeout: float = TIMEOUT):
+        """Connect to the emulator.
+
+        :param emulator: the device model. Defaults to an 8-channel
+            :class:`MPDSEmulator`.
+        :param baudrate: the emulated baud rate. Use 0 to disable the wire
+            time delay.
+        :param latency_s: fixed device processing time per write in [s].
+        :param timeout: read timeout in [s], as in :class:`serial.Serial`.
+        """
+        self.emulator = emulator or MPDSEmulator()
+        self.byte_time_s = BITS_PER_BYTE / baudrate if baudrate else 0
+        self.latency_s = latency_s
+        self.timeout = timeout
+        self.port = "emulated"
+        self.is_open = True
+        self._pending = []  # [(ready_time, bytes)]
+        self._rx_buffer = bytearray()
+        self.reset_counters()
+
+    def reset_counters(self):
+        """Zero the traffic counters."""
+        self.writes = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    def write(self, data: bytes):
+        """Send bytes to the emulator."""
+        self.writes += 1
+        self.bytes_written += len(data)
+        reply = self.emulator.feed(bytes(data))
+        if reply:
+            # Replies queue up behind any that are still on the wire.
+            start_time = max([time.perf_counter()]
+                             + [ready for ready, _ in self._pending[-1:]])
+            ready_time = start_time + self.latency_s \
+                + len(data) * self.byte_time_s
+            # Each line of a batch reply arrives as soon as it is on the wire.
+            for line in reply.split(EOL_BYTES)[:-1]:
+                ready_time += (len(line) + len(EOL_BYTES)) * self.byte_time_s
+                self._pending.append((ready_time, line + EOL_BYTES))
+            remainder = reply.rsplit(EOL_BYTES, 1)[-1]
+            if remainder:
+                ready_time += len(remainder) * self.byte_time_s
+                self._pending.append((ready_time, remainder))
+        return len(data)
+
+    def _collect(self):
+        """Move replies that have arrived into the receive buffer."""
+        now = time.perf_counter()
+        while self._pending and self._pending[0][0] <= now:
+            self._rx_buffer += self._pending.pop(0)[1]
+
+    @property
+    def in_waiting(self):
+        """Return the number of bytes that can be read without waiting."""
+        self._collect()
+        return len(self._rx_buffer)
+
+    def read(self, size: int = 1):
+        """Read up to `size` bytes, waiting up to the timeout for the first
+        ones to arrive."""
+        deadline = time.perf_counter() + self.timeout
+        self._collect()
+        while not self._rx_buffer and self._pending \
+                and self._pending[0][0] <= deadline:
+            time.sleep(max(self._pending[0][0] - time.perf_counter(), 0))
+            self._collect()
+        if not self._rx_buffer:  # Timed out.
+            time.sleep(max(deadline - time.perf_counter(), 0))
+            return b""
+        data = bytes(self._rx_buffer[:size])
+        del self._rx_buffer[:size]
+        self.bytes_read += len(data)
+        return data
+
+    def read_until(self, expected: bytes = b"\n", size: int = None):
+        """Read until `expected`, `size` bytes, or a timeout."""
+        data = bytearray()
+        while not data.endswith(expected) \
+                and (size is None or len(data) < size):
+            byte = self.read(1)
+            if not byte:
+                break
+            data += byte
+        return bytes(data)
+
+    def reset_input_buffer(self):
+        """Discard received and in-flight replies."""
+        self._pending.clear()
+        self._rx_buffer.clear()
+
+    def reset_output_buffer(self):
+        """Nothing to discard; writes are delivered immediately."""
+
+    def close(self):
+        """Close the transport."""
+        self.is_open = False
+
+
+class PtyEmulator:
+    """Serve an :class:`MPDSEmulator` on a Linux pseudo-terminal.
+
+    Connect to it with ``MPDS(pty_emulator.port)``. Replies are delayed by
+    the time the command and reply would take on the wire at the emulated
+    baud rate, plus a fixed processing latency.
+    """
+
+    def __init__(self, emulator: MPDSEmulator = None,
+                 baudrate: int = BAUDRATE, latency_s: float = 0.0):
+        """Open the pseudo-terminal.
+
+        :param emulator: the device model to serve. Defaults to an 8-channel
+            :class:`MPDSEmulator`.
+        :param baudrate: the emulated baud rate. Use 0 to disable the wire
+            time delay.
+        :param latency_s: fixed device processing time per write in [s].
+        """
+        import tty  # Unix-only.
+        self.emulator = emulator or MPDSEmulator()
+        self.byte_time_s = BITS_PER_BYTE / baudrate if baudrate else 0
+        self.latency_s = latency_s
+        self._master_fd, self._slave_fd = os.openpty()
+        # Pass '\n\r' through unmodified.
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="MPDS pty emulator")
+
+    def start(self):
+        """Start serving the emulator."""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the pseudo-terminal."""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+
+    def __enter__(self):
+        """Start serving the emulator."""
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        """Stop serving the emulator."""
+        self.stop()
+
+    def _run(self):
+        """Relay bytes between the pseudo-terminal and the emulator."""
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self._master_fd], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master_fd, 4096)
+            except OSError:  # The port was closed.
+                return
+            reply = self.emulator.feed(data)
+            delay_s = (len(data) + len(reply)) * self.byte_time_s \
+                + self.latency_s
+            if delay_s:
+                time.sleep(delay_s)
+            if reply:
+                os.write(self._master_fd, reply)
+
+
+def main():
+    """Serve an emulated MPDS on a pseudo-terminal until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, default=8, choices=(1, 4, 8),
+                        help="number of channels of the emulated model.")
+    parser.add_argument("--min_freq", type=float,
+                        default=DEFAULT_FREQ_RANGE_MHZ[0],
+                        help="factory minimum frequency [MHz].")
+    parser.add_argument("--max_freq", type=float,
+                        default=DEFAULT_FREQ_RANGE_MHZ[1],
+                        help="factory maximum frequency [MHz].")
+    parser.add_argument("--baudrate", type=int, default=BAUDRATE,
+                        help="emulated baud rate. 0 disables wire delays.")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="device processing time per write [s].")
+    parser.add_argument("--preamble", default=False, action="store_true",
+                        help="start the lines status with Temp/Alim/USB.")
+    args = parser.parse_args()
+    emulator = MPDSEmulator(args.channels, (args.min_freq, args.max_freq),
+                            preamble=args.preamble)
+    with PtyEmulator(emulator, args.baudrate, args.latency) as pty:
+        print(f"Emulated MPDS listening on {pty.port}. Ctrl-C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Single-threaded owner of a serial port that runs queued transactions."""
+
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+# Lower values run first.
+PRIORITY_HIGH = 0  # latency-critical commands, e.g: channel on/off.
+PRIORITY_NORMAL = 1  # other commands.
+PRIORITY_LOW = 2  # housekeeping queries.
+
+
+class IOWorker:
+    """Run transactions on a dedicated thread in priority order.
+
+    A transaction (a write and its replies) is never interrupted, but queued
+    high-priority transactions jump ahead of queued low-priority ones, so a
+    channel toggle only ever waits for the transaction in progress.
+    """
+
+    def __init__(self, name: str = "MPDS I/O worker"):
+        """Start the worker thread.
+
+        :param name: name of the worker thread.
+        """
+        self._queue = queue.PriorityQueue()
+        # Tie-breaker that keeps equal-priority transactions in FIFO order.
+        self._sequence = itertools.count()
+        # Keeps transactions from being queued after the stop sentinel.
+        self._stop_lock = threading.Lock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=name)
+        self._thread.start()
+
+    def submit(self, priority: int, func: Callable, *args) -> Future:
+        """Queue `func(*args)` and return a future for its result.
+
+        :raises RuntimeError: if the worker has been stopped.
+        """
+        future = Future()
+        with self._stop_lock:
+            if self._stopped:
+                raise RuntimeError("The I/O worker has been stopped.")
+            self._queue.put((priority, next(self._sequence), func, args,
+                             future))
+        return future
+
+    def call(self, priority: int, func: Callable, *args):
+        """Queue `func(*args)`, wait for it, and return its result.
+
+        :raises RuntimeError: if the worker has been stopped.
+        """
+        if threading.current_thread() is self._thread:  # Avoid deadlock.
+            return func(*args)
+        return self.submit(priority, func, *args).result()
+
+    def stop(self):
+        """Finish the queued transactions and stop the worker thread."""
+        with self._stop_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            # Sort after everything already queued.
+            self._queue.put((float('inf'), next(self._sequence), None, (),
+                             None))
+        self._thread.join()
+
+    def _run(self):
+        """Run transactions until stopped."""
+        while True:
+            _, _, func, args, future = self._queue.get()
+            if func is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
@@ -0,0 +1,101 @@
+"""Drive several AOTF devices concurrently."""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from aaopto_aotf.aotf import MPDS
+
+
+class PoolResult(NamedTuple):
+    """Outcome of a call fanned out over the devices of a pool."""
+    results: dict  # {com_port: return value} for devices that succeeded.
+    errors: dict  # {com_port: exception} for devices that failed.
+
+
+class MPDSPool:
+    """Open many MPDS devices and run calls on all of them concurrently.
+
+    Each call runs on one worker thread per device, so its duration scales
+    with the slowest device rather than the sum of all devices. Failures are
+    collected per device instead of aborting the other devices.
+    """
+
+    def __init__(self, com_ports: Iterable[str],
+                 max_age: Optional[float] = None, **kwds):
+        """Connect to every device concurrently.
+
+        Devices that fail to connect are left out of :attr:`devices` and their
+        exceptions are stored in :attr:`connect_errors`.
+
+        :param com_ports: names of the serial ports as they appear on the pc.
+        :param max_age: see :class:`~aaopto_aotf.aotf.BaseMPDS`.
+        :param kwds: passed on to every :class:`~aaopto_aotf.aotf.MPDS`,
+            e.g: a shared `descriptor_cache` for faster connection.
+        """
+        com_ports = list(com_ports)
+        self._executor = ThreadPoolExecutor(max_workers=max(len(com_ports), 1))
+        outcome = self._map(lambda port: MPDS(port, max_age, **kwds),
+                            com_ports)
+        self.devices = outcome.results
+        self.connect_errors = outcome.errors
+
+    def _map(self, func: Callable, com_ports: Iterable[str]):
+        """Call `func(com_port)` for every port concurrently."""
+        futures = {port: self._executor.submit(func, port)
+                   for port in com_ports}
+        results = {}
+        errors = {}
+        for port, future in futures.items():
+            try:
+                results[port] = future.result()
+            except Exception as e:
+                errors[port] = e
+        return PoolResult(results, errors)
+
+    def run(self, func: Callable, com_ports: Optional[Iterable[str]] = None):
+        """Call `func(aotf)` on every device concurrently.
+
+        :param func: callable taking an :class:`~aaopto_aotf.aotf.MPDS`.
+        :param com_ports: the devices to run on. Defaults to all of them.
+        :return: a :class:`PoolResult` keyed by port.
+        """
+        if com_ports is None:
+            com_ports = self.devices
+        return self._map(lambda port: func(self.devices[port]), com_ports)
+
+    def get_lines_status(self):
+        """Return the line status of every device."""
+        return self.run(MPDS.get_lines_status)
+
+    def apply(self, settings: dict, validate: bool = True):
+        """Apply per-device bulk channel settings.
+
+        :param settings: dict, keyed by port, of the settings to pass to
+            :meth:`~aaopto_aotf.aotf.MPDS.apply`.
+        :param validate: see :meth:`~aaopto_aotf.aotf.MPDS.apply`.
+        """
+        return self._map(
+            lambda port: self.devices[port].apply(settings[port], validate),
+            settings)
+
+    def save_profile(self):
+        """Save the current settings of every device to its current
+        profile."""
+        return self.run(MPDS.save_profile)
+
+    def reset(self):
+        """Reset every device."""
+        return self.run(MPDS.reset)
+
+    def close(self):
+        """Close every device and stop the worker threads."""
+        self.run(MPDS.close)
+        self._executor.shutdown()
+
+    def __enter__(self):
+        """Return the pool itself."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close every device."""
+        self.close()
@@ -0,0 +1,84 @@
+"""Precompiled parsers for the replies issued by the AOTF.
+
+The patterns mirror the format templates in :obj:`~Replies` and in
+:meth:`~aaopto_aotf.aotf.MPDS.get_lines_status` but are compiled once at
+import so that parsing a reply costs one regex match and a few conversions.
+"""
+
+import re
+from typing import Optional, Tuple
+
+from aaopto_aotf.device_codes import (BlankingMode, ChannelStatus, InputMode,
+                                      OutputState)
+
+# Equivalent to Replies.CHANNEL_SPECIFIC_STATUS.
+CHANNEL_STATUS_PATTERN = re.compile(
+    r"l(\d+)F([-+]?\d*\.\d+)P([-+]?\d*\.\d+)S(\d)")
+# Equivalent to "l{channel} F={freq:.3f} P={power:.3f} {state} {mode}".
+LINE_STATUS_PATTERN = re.compile(
+    r"l(\d+)\s+F=([-+]?\d*\.\d+)\s+P=([-+]?\d*\.\d+)\s+(\w+)\s+(\w+)")
+# Equivalent to "{blanking} {state} {mode}".
+BLANKING_STATUS_PATTERN = re.compile(r"(\w+)\s+(\w+)\s+(\w+)")
+# Housekeeping lines, e.g: "Temp = 0", that some units print before the
+# channel lines of the lines status.
+PREAMBLE_PATTERN = re.compile(r"(?:Temp|Alim|USB)\s*=\s*\S*")
+
+# Plain dict lookups are cheaper than calling the enum classes.
+_OUTPUT_STATE_VALUES = {state.value: state for state in OutputState}
+_OUTPUT_STATE_NAMES = {state.name: state for state in OutputState}
+_INPUT_MODE_NAMES = {mode.name: mode for mode in InputMode}
+_BLANKING_MODE_NAMES = {mode.name: mode for mode in BlankingMode}
+
+
+def parse_channel_status(reply: str) -> ChannelStatus:
+    """Parse a channel-specific status reply.
+
+    :raises ValueError: if the reply is not a channel-specific status.
+    """
+    match = CHANNEL_STATUS_PATTERN.fullmatch(reply)
+    if match is None:
+        raise ValueError(f"Could not parse channel status: {reply!r}")
+    channel, freq, power, state = match.groups()
+    return ChannelStatus(int(channel), float(freq), float(power),
+                         _OUTPUT_STATE_VALUES[state])
+
+
+def parse_line_status(line: str) -> Optional[Tuple[int, dict]]:
+    """Parse one channel line of the lines status reply.
+
+    :return: the channel index and a dict of its settings, or None if the
+        line does not describe a channel.
+    """
+    match = LINE_STATUS_PATTERN.fullmatch(line)
+    if match is None:
+        return None
+    channel, freq, power, state, mode = match.groups()
+    try:
+        return int(channel), {'freq': float(freq), 'power': float(power),
+                              'state': _OUTPUT_STATE_NAMES[state],
+                              'mode': _INPUT_MODE_NAMES[mode]}
+    except KeyError:
+        return None
+
+
+def is_preamble_line(line: str) -> bool:
+    """Return True if a line of the lines status reply is one of the
+    housekeeping lines that precede the channel lines on some units."""
+    return PREAMBLE_PATTERN.fullmatch(line) is not None
+
+
+def parse_blanking_status(line: str) -> Optional[Tuple[str, dict]]:
+    """Parse the last (blanking) line of the lines status reply.
+
+    :return: the lower-case line name and a dict of its settings, or None if
+        the line could not be parsed.
+    """
+    match = BLANKING_STATUS_PATTERN.fullmatch(line)
+    if match is None:
+        return None
+    name, state, mode = match.groups()
+    try:
+        return name.lower(), {'state': _OUTPUT_STATE_NAMES[state],
+                              'mode': _BLANKING_MODE_NAMES[mode]}
+    except KeyError:
+        return None
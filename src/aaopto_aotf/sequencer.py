@@ -0,0 +1,100 @@
+"""Software-timed playback of precompiled channel switching sequences."""
+
+import statistics
+import time
+from typing import Iterable, NamedTuple, Optional
+
+from aaopto_aotf.aotf import MPDS
+from aaopto_aotf.io_worker import PRIORITY_HIGH
+
+# Sleep until this long before a step is due, then busy-wait the rest, since
+# time.sleep() can overshoot by a scheduler quantum.
+SPIN_TIME_S = 0.002
+
+
+class Step(NamedTuple):
+    """One entry of a sequence. Unset (None) settings are left unchanged."""
+    time_s: float  # Offset from the start of playback.
+    channel: int
+    enabled: Optional[bool] = None
+    dbm: Optional[float] = None
+    freq: Optional[float] = None  # [MHz]
+
+
+class PlaybackReport(NamedTuple):
+    """Scheduled and actual send times of every step, relative to the start
+    of playback, in [s]."""
+    scheduled_s: list
+    sent_s: list
+
+    @property
+    def jitter_s(self):
+        """Return the lateness of every step in [s]."""
+        return [sent - scheduled
+                for scheduled, sent in zip(self.scheduled_s, self.sent_s)]
+
+    def jitter_stats(self):
+        """Return summary statistics of the lateness in [s]."""
+        jitter = sorted(self.jitter_s)
+        if not jitter:
+            return {}
+        return {'mean': statistics.mean(jitter),
+                'stdev': statistics.pstdev(jitter),
+                'min': jitter[0],
+                'median': statistics.median(jitter),
+                'p99': jitter[min(int(0.99 * len(jitter)), len(jitter) - 1)],
+                'max': jitter[-1]}
+
+
+class Sequencer:
+    """Play a list of steps on an :class:`~aaopto_aotf.aotf.MPDS` with a
+    :func:`time.perf_counter` based scheduler.
+
+    All commands are encoded when the sequencer is created, so playback only
+    waits, writes, and reads replies. The device cache is updated from the
+    replies after every step, so it stays correct if playback stops early.
+    """
+
+    def __init__(self, aotf: MPDS, steps: Iterable[Step],
+                 spin_time_s: float = SPIN_TIME_S):
+        """Check and pre-encode the steps.
+
+        :param aotf: the device to play the sequence on.
+        :param steps: the steps to play, in any order.
+        :param spin_time_s: how long before each step to stop sleeping and
+            busy-wait instead.
+        """
+        self.aotf = aotf
+        self.spin_time_s = spin_time_s
+        self.steps = sorted(steps, key=lambda step: step.time_s)
+        self._encoded = [self._encode(step) for step in self.steps]
+
+    def _encode(self, step: Step):
+        """Encode one step as a single write with
+        :meth:`~aaopto_aotf.aotf.MPDS.encode_apply`."""
+        ch_settings = {key: value for key, value in
+                       (('enabled', step.enabled), ('dbm', step.dbm),
+                        ('freq', step.freq))
+                       if value is not None}
+        return self.aotf.encode_apply({step.channel: ch_settings},
+                                      validate=False)
+
+    def play(self):
+        """Play the sequence once and return a :class:`PlaybackReport`."""
+        aotf = self.aotf
+        perf_counter = time.perf_counter
+        sent_s = []
+        start_time = perf_counter()
+        for step, encoded in zip(self.steps, self._encoded):
+            due_time = start_time + step.time_s
+            remaining_s = due_time - perf_counter()
+            if remaining_s > self.spin_time_s:
+                time.sleep(remaining_s - self.spin_time_s)
+            while perf_counter() < due_time:
+                pass
+            # Includes any wait for the port, e.g: behind a status poll.
+            write_time = aotf.apply_encoded(encoded, PRIORITY_HIGH)
+            if write_time is None:  # Nothing to send.
+                write_time = perf_counter()
+            sent_s.append(write_time - start_time)
+        return PlaybackReport([step.time_s for step in self.steps], sent_s)
@@ -0,0 +1,60 @@
+"""Write-through copy of the AOTF settings to avoid redundant serial reads."""
+
+import time
+from typing import Any, Hashable, Optional
+
+
+class ShadowState:
+    """Timestamped cache of device settings keyed by (key, field).
+
+    Keys follow the layout of :meth:`~aaopto_aotf.aotf.MPDS.get_lines_status`,
+    i.e: integer channel indices, ``'blanking'``, plus ``'device'`` for global
+    settings that cannot be read back from the hardware.
+    """
+
+    def __init__(self, max_age: Optional[float] = None):
+        """Create an empty cache.
+
+        :param max_age: default age in [s] beyond which a cached value is
+            considered stale. If None, cached values never expire.
+        """
+        self.max_age = max_age
+        self._values = {}  # {(key, field): (value, timestamp)}
+
+    def update(self, key: Hashable, **fields: Any):
+        """Store one or more field values for the specified key."""
+        now = time.monotonic()
+        for field, value in fields.items():
+            self._values[(key, field)] = (value, now)
+
+    def get(self, key: Hashable, field: str,
+            max_age: Optional[float] = None) -> Any:
+        """Return the cached value or None if it is missing or stale.
+
+        :param key: channel index, ``'blanking'``, or ``'device'``.
+        :param field: name of the setting.
+        :param max_age: age in [s] beyond which the value is considered stale.
+            If None, defer to the cache-wide default. ``0`` always misses.
+        """
+        try:
+            value, timestamp = self._values[(key, field)]
+        except KeyError:
+            return None
+        max_age = self.max_age if max_age is None else max_age
+        if max_age is not None and time.monotonic() - timestamp >= max_age:
+            return None
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None, *fields: str):
+        """Drop cached values.
+
+        :param key: the key to drop. If None, drop everything.
+        :param fields: the fields to drop. If empty, drop all fields of `key`.
+        """
+        if key is None:
+            self._values.clear()
+            return
+        for cached_key, field in list(self._values):
+            if cached_key == key and (not fields or field in fields):
+                # Another thread may have dropped it since the copy.
+                self._values.pop((cached_key, field), None)
@@ -0,0 +1,206 @@
+"""Low-overhead per-command traffic and latency statistics."""
+
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Callable, NamedTuple, Optional
+
+from aaopto_aotf.device_codes import EOL, CmdRoots
+
+# Upper edges of the latency histogram buckets in [s]. Slower transactions
+# land in a final overflow bucket.
+LATENCY_BUCKETS_S = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1,
+                     0.2, 0.5, 1.0)
+
+_EOL_BYTES = EOL.encode('ascii')
+_CHANNEL_PREFIX_BYTES = CmdRoots.CHANNEL_PREFIX.value.encode('ascii')
+
+
+@lru_cache(maxsize=4096)
+def command_root(data: bytes):
+    """Return the :obj:`~CmdRoots` of one pre-encoded message.
+
+    Channel-prefixed messages are keyed by the command that follows the
+    channel index; a bare channel-specific status query is keyed by
+    :obj:`~CmdRoots.CHANNEL_PREFIX`. Unknown roots are returned as strings.
+    """
+    if data[:1] == _CHANNEL_PREFIX_BYTES:
+        data = data[1:].lstrip(b"0123456789")
+        if data[:1] in (b"", _EOL_BYTES[:1]):
+            return CmdRoots.CHANNEL_PREFIX
+    root = data[:1].decode('ascii', 'replace')
+    try:
+        return CmdRoots(root)
+    except ValueError:
+        return root
+
+
+class Transaction(NamedTuple):
+    """One recorded write and its reply, as passed to the stats hook."""
+    root: object  # :obj:`~CmdRoots`, or a string if unknown.
+    bytes_written: int
+    bytes_read: int
+    latency_s: float  # Write to end of reply, or the write alone.
+    timed_out: bool
+
+
+class CommandStats:
+    """Call counts, traffic, and latency histograms keyed by command root.
+
+    Recording a transaction costs a few integer updates, so stats are always
+    on. An optional `hook` is called with every :class:`Transaction` to feed
+    an external metrics system.
+    """
+
+    def __init__(self, hook: Optional[Callable] = None,
+                 buckets_s: tuple = LATENCY_BUCKETS_S):
+        """Start with empty statistics.
+
+        :param hook: callable taking a :class:`Transaction`. It runs on the
+            I/O thread, inside the transaction lock, and should return
+            quickly.
+        :param buckets_s: upper edges of the latency histogram buckets in
+            [s], in increasing order.
+        """
+        self.hook = hook
+        self.buckets_s = tuple(buckets_s)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _entry(self, root):
+        """Return (creating it if needed) the counters of one root."""
+        entry = self._stats.get(root)
+        if entry is None:
+            entry = self._stats[root] = {
+                'calls': 0, 'bytes_written': 0, 'bytes_read': 0,
+                'timeouts': 0, 'unparsed': 0, 'desyncs': 0,
+                'latency_sum_s': 0.0,
+                'latency_max_s': 0.0,
+                'histogram': [0] * (len(self.buckets_s) + 1)}
+        return entry
+
+    def record(self, data: bytes, bytes_read: int, latency_s: float,
+               timed_out: bool = False):
+        """Record one message and its reply.
+
+        :param data: the pre-encoded message written.
+        :param bytes_read: length of the reply, terminators included.
+        :param latency_s: time from the write to the end of the reply.
+        :param timed_out: True if the reply did not arrive in full.
+        """
+        root = command_root(data)
+        with self._lock:
+            entry = self._entry(root)
+            entry['calls'] += 1
+            entry['bytes_written'] += len(data)
+            entry['bytes_read'] += bytes_read
+            entry['timeouts'] += timed_out
+            entry['latency_sum_s'] += latency_s
+            if latency_s > entry['latency_max_s']:
+                entry['latency_max_s'] = latency_s
+            entry['histogram'][bisect_left(self.buckets_s, latency_s)] += 1
+        if self.hook is not None:
+            self.hook(Transaction(root, len(data), bytes_read, latency_s,
+                                  timed_out))
+
+    def record_unparsed(self, root):
+        """Count one reply line that could not be parsed."""
+        with self._lock:
+            self._entry(root)['unparsed'] += 1
+
+    def record_desync(self, root):
+        """Count one reply followed by unexpected input."""
+        with self._lock:
+            self._entry(root)['desyncs'] += 1
+
+    def reset(self):
+        """Clear all statistics."""
+        with self._lock:
+            self._stats = {}
+
+    def snapshot(self):
+        """Return a copy of the statistics keyed by command root.
+
+        Each entry holds ``calls``, ``bytes_written``, ``bytes_read``,
+        ``timeouts``, ``unparsed``, ``desyncs``, ``latency_mean_s``,
+        ``latency_max_s``, and ``histogram``, a list of
+        ``(upper_edge_s, count)`` pairs whose last edge is ``inf``.
+        """
+        edges = self.buckets_s + (float('inf'),)
+        with self._lock:
+            stats = {root: dict(entry, histogram=list(entry['histogram']))
+                     for root, entry in self._stats.items()}
+        for entry in stats.values():
+            latency_sum_s = entry.pop('latency_sum_s')
+            entry['latency_mean_s'] = (latency_sum_s / entry['calls']
+                                       if entry['calls'] else 0.0)
+            entry['histogram'] = list(zip(edges, entry['histogram']))
+        return stats
+
+
+def bucket_ceil(value_s: float, buckets_s: tuple = LATENCY_BUCKETS_S):
+    """Round `value_s` up to the next bucket edge (or return it unchanged
+    if it exceeds the last edge)."""
+    index = bisect_left(buckets_s, value_s)
+    return buckets_s[index] if index < len(buckets_s) else value_s
+
+
+class ReplyDeadlines:
+    """Per-command reply deadlines learned from observed latencies.
+
+    A smoothed latency and its mean deviation are tracked per command root,
+    as TCP does for round-trip times, and the deadline allows `margin`
+    deviations on top of the smoothed latency. Deadlines are rounded up to a
+    histogram bucket edge so that they (and the serial port timeout set from
+    them) rarely change.
+    """
+
+    def __init__(self, default_s: float, min_s: float = 0.02,
+                 min_samples: int = 8, margin: float = 4.0):
+        """Start with every deadline at `default_s`.
+
+        :param default_s: deadline used until `min_samples` latencies have
+            been observed, and the upper bound of learned deadlines.
+        :param min_s: lower bound of learned deadlines. Leaves room for
+            USB-serial adapters that hold replies back for a few [ms].
+        :param min_samples: latencies to observe before deadlines adapt.
+        :param margin: number of mean deviations allowed above the smoothed
+            latency.
+        """
+        self.default_s = default_s
+        self.min_s = min_s
+        self.min_samples = min_samples
+        self.margin = margin
+        self._deadlines = {}
+        self._estimates = {}  # root: [count, mean_s, deviation_s]
+
+    def get(self, root) -> float:
+        """Return the reply deadline in [s] of a command root."""
+        return self._deadlines.get(root, self.default_s)
+
+    def observe(self, root, latency_s: float):
+        """Update the deadline of a command root with a reply latency."""
+        estimate = self._estimates.get(root)
+        if estimate is None:
+            estimate = self._estimates[root] = [0, latency_s, latency_s / 2]
+        else:
+            error_s = latency_s - estimate[1]
+            estimate[1] += error_s / 8
+            estimate[2] += (abs(error_s) - estimate[2]) / 4
+        estimate[0] += 1
+        if estimate[0] >= self.min_samples:
+            self._update(root)
+
+    def back_off(self, root):
+        """Double the deadline of a command root after it was missed."""
+        estimate = self._estimates.get(root)
+        if estimate is not None and estimate[0] >= self.min_samples:
+            estimate[1] *= 2
+            estimate[2] *= 2
+            self._update(root)
+
+    def _update(self, root):
+        """Recompute one deadline from its latency estimate."""
+        _, mean_s, deviation_s = self._estimates[root]
+        deadline_s = max(mean_s + self.margin * deviation_s, self.min_s)
+        self._deadlines[root] = min(bucket_ceil(deadline_s), self.default_s)
@@ -0,0 +1,201 @@
+"""Background status polling with an in-memory history of samples."""
+
+import logging
+import threading
+import time
+from array import array
+from typing import Callable, Optional, Union
+
+# Sentinel for enum-valued fields that a sample did not report.
+UNKNOWN = -1
+
+
+class StatusRingBuffer:
+    """Fixed-size, array-backed history of device status samples.
+
+    Samples are stored in preallocated flat arrays (one slot per sample and
+    channel) so that appending never allocates and old samples are
+    overwritten once the buffer is full.
+    """
+
+    def __init__(self, num_channels: int, capacity: int = 1024):
+        """Preallocate storage.
+
+        :param num_channels: number of channels in every sample.
+        :param capacity: number of samples kept before the oldest is
+            overwritten.
+        """
+        self.num_channels = num_channels
+        self.capacity = capacity
+        size = capacity * num_channels
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._freq = array('d', bytes(8 * size))
+        self._power = array('d', bytes(8 * size))
+        self._state = array('b', [UNKNOWN]) * size
+        self._mode = array('b', [UNKNOWN]) * size
+        self._blanking_mode = array('b', [UNKNOWN]) * capacity
+        self._next = 0  # Index of the slot to write next.
+        self._count = 0
+        self._latest = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of samples held."""
+        return self._count
+
+    def append(self, timestamp: float, status: dict):
+        """Store one sample.
+
+        :param timestamp: time of the sample in [s] since the epoch.
+        :param status: dict in the format of
+            :meth:`~aaopto_aotf.aotf.MPDS.get_lines_status`. Missing channels
+            or fields are stored as unknown.
+        """
+        with self._lock:
+            index = self._next
+            self._timestamps[index] = timestamp
+            offset = index * self.num_channels
+            for channel in range(1, self.num_channels + 1):
+                ch_status = status.get(channel, {})
+                slot = offset + channel - 1
+                self._freq[slot] = ch_status.get('freq', float('nan'))
+                self._power[slot] = ch_status.get('power', float('nan'))
+                self._state[slot] = _encode_enum(ch_status.get('state'))
+                self._mode[slot] = _encode_enum(ch_status.get('mode'))
+            self._blanking_mode[index] = _encode_enum(
+                status.get('blanking', {}).get('mode'))
+            self._next = (index + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+            self._latest = (timestamp, status)
+
+    def latest(self):
+        """Return the most recent (timestamp, status) pair, or None."""
+        return self._latest
+
+    def history(self, channel: Union[int, str], field: str):
+        """Return the history of one channel field, oldest first.
+
+        :param channel: the channel index, or ``'blanking'`` for the
+            blanking line.
+        :param field: ``'freq'``, ``'power'``, ``'state'``, or ``'mode'``;
+            only ``'mode'`` for the blanking line. Enum-valued fields are
+            returned as their integer codes, with :obj:`UNKNOWN` where a
+            sample did not report them.
+        :return: lists of timestamps and values.
+        """
+        if channel == 'blanking':
+            values = {'mode': self._blanking_mode}[field]
+            stride, slot = 1, 0
+        else:
+            values = {'freq': self._freq, 'power': self._power,
+                      'state': self._state, 'mode': self._mode}[field]
+            stride, slot = self.num_channels, channel - 1
+        with self._lock:
+            indices = self._ordered_indices()
+            return ([self._timestamps[i] for i in indices],
+                    [values[i * stride + slot] for i in indices])
+
+    def _ordered_indices(self):
+        """Return the indices of the stored samples, oldest first."""
+        start = (self._next - self._count) % self.capacity
+        return [(start + i) % self.capacity for i in range(self._count)]
+
+
+def _encode_enum(value) -> int:
+    """Encode a numeric-string enum value (or None) as a small integer."""
+    return UNKNOWN if value is None else int(value.value)
+
+
+class StatusPoller:
+    """Periodically read the device status on a background thread.
+
+    Samples are stored in a :class:`StatusRingBuffer`, the device settings
+    cache is kept warm, and subscribers are called only when a setting
+    changes between consecutive samples.
+    """
+
+    def __init__(self, aotf, interval_s: float = 0.1, capacity: int = 1024,
+                 lines_status: bool = True):
+        """Prepare (but do not start) the polling thread.
+
+        :param aotf: the :class:`~aaopto_aotf.aotf.MPDS` to poll.
+        :param interval_s: time between the start of consecutive polls.
+        :param capacity: number of samples kept in :attr:`telemetry`.
+        :param lines_status: if True, poll with the lines status query. If
+            False, poll with pipelined channel-specific queries, which are
+            shorter but do not report input and blanking modes.
+        """
+        self.aotf = aotf
+        self.interval_s = interval_s
+        self.lines_status = lines_status
+        self.telemetry = StatusRingBuffer(aotf.num_channels, capacity)
+        self.log = logging.getLogger(f"{__name__}.{aotf.log.name}")
+        self._callbacks = []
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="MPDS status poller")
+
+    def subscribe(self, callback: Callable):
+        """Call `callback(key, changes)` whenever a setting changes.
+
+        `key` is the channel index or ``'blanking'`` and `changes` is a dict
+        of ``{field: (old_value, new_value)}``. Callbacks run on the polling
+        thread and should return quickly.
+        """
+        self._callbacks.append(callback)
+
+    def unsubscribe(self, callback: Callable):
+        """Stop calling `callback`."""
+        self._callbacks.remove(callback)
+
+    def start(self):
+        """Start polling."""
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop polling and wait for the thread to finish."""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _poll(self):
+        """Read one status sample in the format of
+        :meth:`~aaopto_aotf.aotf.MPDS.get_lines_status`."""
+        if self.lines_status:
+            return self.aotf.get_lines_status()
+        return {channel: {'freq': status.freq, 'power': status.power,
+                          'state': status.state}
+                for channel, status
+                in self.aotf.get_all_channel_status().items()}
+
+    def _run(self):
+        """Poll until stopped."""
+        previous = None
+        while not self._stop_event.is_set():
+            start_time = time.perf_counter()
+            try:
+                status = self._poll()
+            except Exception:
+                self.log.exception("Status poll failed.")
+            else:
+                self.telemetry.append(time.time(), status)
+                if previous is not None:
+                    self._notify(previous, status)
+                previous = status
+            elapsed_s = time.perf_counter() - start_time
+            self._stop_event.wait(max(self.interval_s - elapsed_s, 0))
+
+    def _notify(self, previous: dict, status: dict):
+        """Call subscribers with the settings that differ between samples."""
+        for key, settings in status.items():
+            old_settings = previous.get(key, {})
+            changes = {field: (old_settings.get(field), value)
+                       for field, value in settings.items()
+                       if old_settings.get(field) != value}
+            if not changes:
+                continue
+            for callback in list(self._callbacks):
+                try:
+                    callback(key, changes)
+                except Exception:
+                    self.log.exception("Status callback failed.")
@@ -0,0 +1,287 @@
+"""Serial transports that record a device session and replay it offline.
+
+Wrap the port of a real session in a :class:`RecordingSerial` to save every
+write and reply with its timestamp:
+
+.. code-block:: python
+
+    ser = RecordingSerial(Serial(port, BAUDRATE, timeout=TIMEOUT),
+                          "session.rec")
+    aotf = MPDS(port, ser=ser)
+
+Then re-run the same calls without hardware with
+``MPDS(port, ser=ReplaySerial("session.rec"))``.
+"""
+
+import struct
+import time
+from typing import List, NamedTuple
+
+from aaopto_aotf.aotf import TIMEOUT
+
+# First bytes of a recording file.
+MAGIC = b"MPDSREC1"
+# Each event is a kind byte, the time since the recording started in [s],
+# and the length of the data that follows.
+EVENT_HEADER = struct.Struct("<cdI")
+WRITE = b"W"
+READ = b"R"
+
+
+class SessionEvent(NamedTuple):
+    """One recorded write or read."""
+    kind: bytes  # WRITE or READ.
+    time_s: float  # Since the recording started.
+    data: bytes
+
+
+class ReplayMismatchError(ValueError):
+    """A replayed write does not match the recording."""
+
+
+class RecordingSerial:
+    """Serial port wrapper that saves every write and every non-empty read
+    to a recording file, with timestamps."""
+
+    def __init__(self, ser, path: str):
+        """Start recording.
+
+        :param ser: the open :class:`serial.Serial` (or serial-like) port.
+        :param path: the recording file to create.
+        """
+        self.ser = ser
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._start_time = time.perf_counter()
+
+    def _record(self, kind: bytes, time_s: float, data: bytes):
+        """Append one event to the recording file."""
+        self._file.write(EVENT_HEADER.pack(kind, time_s, len(data)))
+        self._file.write(data)
+
+    def write(self, data: bytes):
+        """Write bytes to the port and record them."""
+        time_s = time.perf_counter() - self._start_time
+        num_written = self.ser.write(data)
+        self._record(WRITE, time_s, bytes(data))
+        return num_written
+
+    def read(self, size: int = 1):
+        """Read from the port and record what arrived."""
+        data = self.ser.read(size)
+        if data:
+            self._record(READ, time.perf_counter() - self._start_time, data)
+        return data
+
+    def read_until(self, expected: bytes = b"\n", size: int = None):
+        """Read from the port until `expected` and record what arrived."""
+        data = self.ser.read_until(expected, size)
+        if data:
+            self._record(READ, time.perf_counter() - self._start_time, data)
+        return data
+
+    @property
+    def in_waiting(self):
+        """Return the number of bytes that can be read without waiting."""
+        return self.ser.in_waiting
+
+    @property
+    def timeout(self):
+        """Return the read timeout of the port."""
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, timeout_s: float):
+        """Set the read timeout of the port."""
+        self.ser.timeout = timeout_s
+
+    def reset_input_buffer(self):
+        """Discard unread input of the port."""
+        self.ser.reset_input_buffer()
+
+    def reset_output_buffer(self):
+        """Discard unsent output of the port."""
+        self.ser.reset_output_buffer()
+
+    def close(self):
+        """Close the port and finish the recording file."""
+        self.ser.close()
+        self._file.close()
+
+    def __getattr__(self, name):
+        """Expose other port attributes (e.g: `port`, `baudrate`)."""
+        return getattr(self.ser, name)
+
+
+def load_session(path: str) -> List[SessionEvent]:
+    """Return the events of a recording file in order.
+
+    A truncated final event (e.g: from a crash while recording) is dropped.
+    """
+    with open(path, 'rb') as session_file:
+        contents = session_file.read()
+    if not contents.startswith(MAGIC):
+        raise ValueError(f"{path} is not a session recording.")
+    events = []
+    offset = len(MAGIC)
+    while offset + EVENT_HEADER.size <= len(contents):
+        kind, time_s, size = EVENT_HEADER.unpack_from(contents, offset)
+        offset += EVENT_HEADER.size
+        if offset + size > len(contents):
+            break
+        events.append(SessionEvent(kind, time_s,
+                                   contents[offset:offset + size]))
+        offset += size
+    return events
+
+
+class ReplaySerial:
+    """Serial-like transport that answers writes with the replies of a
+    recording.
+
+    Each write is matched against the recorded writes, and the bytes read
+    after the matching write (up to the next write) become readable. A write
+    may also match several consecutive recorded writes at once, so drivers
+    that batch messages differently still replay. Traffic counters make it
+    suitable for comparing round trips and bytes per call between driver
+    versions.
+    """
+
+    def __init__(self, session, realtime: bool = False,
+                 strict: bool = True, timeout: float = TIMEOUT):
+        """Load the recording.
+
+        :param session: a recording file path, or the events returned by
+            :func:`load_session`.
+        :param realtime: if True, delay each reply by its recorded latency
+            and let reads without a reply wait out the timeout. Otherwise
+            replies are readable immediately and missing ones time out
+            at once.
+        :param strict: if True, every write must match the next recorded
+            write. Otherwise recorded writes that the driver no longer sends
+            are skipped (and counted in :attr:`skipped`).
+        :param timeout: read timeout in [s], as in :class:`serial.Serial`.
+        """
+        if isinstance(session, str):
+            session = load_session(session)
+        self.realtime = realtime
+        self.strict = strict
+        self.timeout = timeout
+        self.port = "replay"
+        self.is_open = True
+        # [(written bytes, [(latency_s, reply chunk)])]
+        self._exchanges = []
+        for kind, time_s, data in session:
+            if kind == WRITE:
+                write_time_s = time_s
+                self._exchanges.append((data, []))
+            elif self._exchanges:  # Input before the first write is stale.
+                self._exchanges[-1][1].append((time_s - write_time_s, data))
+        self._next = 0
+        self.skipped = 0
+        self._pending = []  # [(ready_time, bytes)]
+        self._rx_buffer = bytearray()
+        self.reset_counters()
+
+    @property
+    def remaining(self):
+        """Return the number of recorded writes not replayed yet."""
+        return len(self._exchanges) - self._next
+
+    def reset_counters(self):
+        """Zero the traffic counters."""
+        self.writes = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    def rewind(self):
+        """Replay the recording from the start again."""
+        self._next = 0
+        self.skipped = 0
+        self.reset_input_buffer()
+
+    def _match(self, data: bytes):
+        """Return the index of the recorded write that `data` starts with."""
+        stop = self._next + 1 if self.strict else len(self._exchanges)
+        for index in range(self._next, min(stop, len(self._exchanges))):
+            written = self._exchanges[index][0]
+            if written and data.startswith(written):
+                return index
+        raise ReplayMismatchError(f"{data!r} does not match the recording "
+                                  f"after {self._next} writes.")
+
+    def write(self, data: bytes):
+        """Queue the recorded replies to `data`.
+
+        :raises ReplayMismatchError: if `data` is not in the recording.
+        """
+        self.writes += 1
+        self.bytes_written += len(data)
+        now = time.perf_counter()
+        remaining = bytes(data)
+        while remaining:
+            index = self._match(remaining)
+            written, chunks = self._exchanges[index]
+            self.skipped += index - self._next
+            self._next = index + 1
+            remaining = remaining[len(written):]
+            for latency_s, chunk in chunks:
+                ready_time = now + latency_s if self.realtime else now
+                if self._pending:  # Replies arrive in order.
+                    ready_time = max(ready_time, self._pending[-1][0])
+                self._pending.append((ready_time, chunk))
+        return len(data)
+
+    def _collect(self):
+        """Move replies that have arrived into the receive buffer."""
+        now = time.perf_counter()
+        while self._pending and self._pending[0][0] <= now:
+            self._rx_buffer += self._pending.pop(0)[1]
+
+    @property
+    def in_waiting(self):
+        """Return the number of bytes that can be read without waiting."""
+        self._collect()
+        return len(self._rx_buffer)
+
+    def read(self, size: int = 1):
+        """Read up to `size` bytes, waiting up to the timeout for the first
+        ones to arrive."""
+        deadline = time.perf_counter() + self.timeout
+        self._collect()
+        while not self._rx_buffer and self._pending \
+                and self._pending[0][0] <= deadline:
+            time.sleep(max(self._pending[0][0] - time.perf_counter(), 0))
+            self._collect()
+        if not self._rx_buffer:  # Timed out.
+            if self.realtime:
+                time.sleep(max(deadline - time.perf_counter(), 0))
+            return b""
+        data = bytes(self._rx_buffer[:size])
+        del self._rx_buffer[:size]
+        self.bytes_read += len(data)
+        return data
+
+    def read_until(self, expected: bytes = b"\n", size: int = None):
+        """Read until `expected`, `size` bytes, or a timeout."""
+        data = bytearray()
+        while not data.endswith(expected) \
+                and (size is None or len(data) < size):
+            byte = self.read(1)
+            if not byte:
+                break
+            data += byte
+        return bytes(data)
+
+    def reset_input_buffer(self):
+        """Discard received and in-flight replies."""
+        self._pending.clear()
+        self._rx_buffer.clear()
+
+    def reset_output_buffer(self):
+        """Nothing to discard; writes are answered immediately."""
+
+    def close(self):
+        """Close the transport."""
+        self.is_open = False
@@ -0,0 +1,139 @@
+"""Tuning curves from optical wavelength to acoustic frequency.
+
+Note: requires numpy.
+"""
+
+import json
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Fitted in inverse micrometers, where the curve is nearly linear.
+NM_PER_UM = 1000.0
+
+
+class TuningCurve:
+    """Acoustic frequency [MHz] that diffracts each optical wavelength [nm]
+    through one crystal.
+
+    The frequency of an AOTF is close to proportional to the inverse of the
+    wavelength, so it is modelled as a low-order polynomial of the inverse
+    wavelength, which also absorbs the dispersion of the crystal.
+    """
+
+    def __init__(self, coefficients, min_nm: float = None,
+                 max_nm: float = None):
+        """Build the curve.
+
+        :param coefficients: polynomial coefficients of the frequency in
+            [MHz] as a function of the inverse wavelength in [1/um], highest
+            power first.
+        :param min_nm: shortest wavelength the curve was fit to, if known.
+        :param max_nm: longest wavelength the curve was fit to, if known.
+            If both are known, wavelengths outside of them are rejected.
+        """
+        if np is None:
+            raise ImportError("Tuning curves require numpy. Install it with "
+                              "`pip install aaopto-aotf[calibration]`.")
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.min_nm = min_nm
+        self.max_nm = max_nm
+        # Lasers are swapped between the same few wavelengths, and channels
+        # between the same few sets of them.
+        self._scalar_freq = lru_cache(maxsize=1024)(self._evaluate)
+        self._table = lru_cache(maxsize=64)(self._evaluate_table)
+
+    @classmethod
+    def fit(cls, wavelengths_nm, freqs_mhz, degree: int = 2):
+        """Fit a curve to the optimal frequencies measured at several
+        wavelengths, e.g: the peaks found by the calibration sweep.
+
+        :param wavelengths_nm: the wavelengths in [nm].
+        :param freqs_mhz: the optimal frequency in [MHz] at each wavelength.
+        :param degree: polynomial degree. Needs more peaks than this.
+        """
+        if np is None:
+            raise ImportError("Tuning curves require numpy. Install it with "
+                              "`pip install aaopto-aotf[calibration]`.")
+        wavelengths_nm = np.asarray(wavelengths_nm, dtype=float)
+        if len(np.unique(wavelengths_nm)) <= degree:
+            raise ValueError(f"A degree {degree} tuning curve needs at least "
+                             f"{degree + 1} different wavelengths.")
+        coefficients = np.polyfit(NM_PER_UM / wavelengths_nm,
+                                  np.asarray(freqs_mhz, dtype=float), degree)
+        return cls(coefficients, float(wavelengths_nm.min()),
+                   float(wavelengths_nm.max()))
+
+    def _check_range(self, wavelengths_nm):
+        """Raise a ValueError if any wavelength is outside of the fit."""
+        if self.min_nm is None or self.max_nm is None:
+            return
+        if np.min(wavelengths_nm) < self.min_nm \
+                or np.max(wavelengths_nm) > self.max_nm:
+            raise ValueError(f"Wavelengths must be within the fitted range "
+                             f"of {self.min_nm} to {self.max_nm} [nm].")
+
+    def _evaluate(self, wavelength_nm: float) -> float:
+        """Return the frequency of one wavelength."""
+        self._check_range(wavelength_nm)
+        return float(np.polyval(self.coefficients,
+                                NM_PER_UM / wavelength_nm))
+
+    def _evaluate_table(self, items: tuple) -> tuple:
+        """Return the (channel, frequency) pairs of (channel, wavelength)
+        pairs."""
+        channels = [channel for channel, _ in items]
+        freqs = self.freq([wavelength for _, wavelength in items])
+        return tuple(zip(channels, freqs.tolist()))
+
+    def freq(self, wavelength_nm):
+        """Return the frequency [MHz] that diffracts a wavelength [nm].
+
+        :param wavelength_nm: a number or an array.
+        :raises ValueError: if a wavelength is outside of :attr:`min_nm` to
+            :attr:`max_nm`, when both are known.
+        """
+        if np.ndim(wavelength_nm) == 0:
+            return self._scalar_freq(float(wavelength_nm))
+        wavelength_nm = np.asarray(wavelength_nm, dtype=float)
+        if wavelength_nm.size:
+            self._check_range(wavelength_nm)
+        return np.polyval(self.coefficients, NM_PER_UM / wavelength_nm)
+
+    def frequency_table(self, wavelengths: dict):
+        """Return the frequencies of many channels in one vectorized pass.
+
+        :param wavelengths: dict of wavelengths in [nm] keyed by channel.
+        :return: dict of frequencies in [MHz] keyed by channel.
+        :raises ValueError: see :meth:`freq`.
+        """
+        if not wavelengths:
+            return {}
+        return dict(self._table(tuple(wavelengths.items())))
+
+    def to_dict(self):
+        """Return the curve as a JSON-serializable dict."""
+        return {'coefficients': self.coefficients.tolist(),
+                'min_nm': self.min_nm, 'max_nm': self.max_nm}
+
+
+class TuningCurves(dict):
+    """:class:`TuningCurve` per crystal, keyed by a name of your choice
+    (e.g: the device serial number), stored as JSON."""
+
+    @classmethod
+    def load(cls, path: str):
+        """Load curves saved with :meth:`save`."""
+        with open(path, 'r') as tuning_file:
+            curves = json.load(tuning_file)
+        return cls({name: TuningCurve(**curve)
+                    for name, curve in curves.items()})
+
+    def save(self, path: str):
+        """Save every curve to a JSON file."""
+        with open(path, 'w') as tuning_file:
+            json.dump({name: curve.to_dict() for name, curve in self.items()},
+                      tuning_file, indent=2)